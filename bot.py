@@ -1,17 +1,30 @@
+import sys
+import time
+
+STARTED = time.perf_counter()
+PROFILE_STARTUP = '--profile-startup' in sys.argv
+if PROFILE_STARTUP:
+    # Installed before anything else is imported so every import is timed
+    from unity_util import startup_profile
+    startup_profile.install()
+
 import discord
 from discord.ext import commands
 import json
 import logging
 from unity_util import bot_config
-import sys
+from unity_util import database
+from unity_util import http_client
+from unity_util import metrics
+from unity_util.message_router import MessageRouter
+from unity_util.log_config import setup_logging
 
 with open('config.json', 'r') as f:
     conf = json.load(f)
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
+log_listener = setup_logging(f'./logs/{bot_config.LOGGING_FILENAME}', max_bytes=bot_config.LOGGING_MAX_BYTES,
+                             backup_count=bot_config.LOGGING_BACKUP_COUNT, rotate_when=bot_config.LOGGING_ROTATE_WHEN,
+                             json_format=bot_config.LOGGING_JSON)
 
 intents = discord.Intents(
     guilds=True,
@@ -25,13 +38,87 @@ intents = discord.Intents(
     guild_reactions=True,
     dm_reactions=True
 )
-client = commands.Bot(command_prefix = bot_config.DISCORD_PREFIX, intents=intents)
+class Bot(commands.Bot):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # (event name, listener) -> the timed wrapper registered in its place, so it can be removed again
+        self.timed_listeners = {}
+        # Cogs register their message handlers here by channel or content rather than with on_message
+        self.router = MessageRouter(self.loop)
+        self.add_listener(self.router.on_message, 'on_message')
+        # Extension name -> names of the stub command that stands in for it until it's first used
+        self.lazy_extensions = {}
+
+    def add_lazy_extension(self, extension: str, command_names: list):
+        """Register a stub command for a rarely used cog, which loads the cog and reruns the command on first use"""
+        self.lazy_extensions[extension] = command_names
+        self.add_stub_command(extension)
+
+    def add_stub_command(self, extension: str):
+        names = self.lazy_extensions[extension]
+
+        async def load_and_invoke(ctx, *, arguments: str = None):
+            # Someone else's first use may have loaded it since this stub was looked up
+            if f'unity_cogs.{extension}' not in self.extensions:
+                self.load_extension(f'unity_cogs.{extension}')
+                logging.info(f'{extension} loaded on first use')
+            await self.invoke(await self.get_context(ctx.message))
+
+        self.add_command(commands.Command(load_and_invoke, name=names[0], aliases=names[1:],
+                                          help=f"Loads the {extension} cog on first use"))
+
+    def load_extension(self, name):
+        extension = name.rsplit('.', 1)[-1]
+        if extension in self.lazy_extensions and name not in self.extensions:
+            self.remove_command(self.lazy_extensions[extension][0])
+        start = time.perf_counter()
+        try:
+            super().load_extension(name)
+        except Exception:
+            if extension in self.lazy_extensions and name not in self.extensions:
+                self.add_stub_command(extension)
+            raise
+        if PROFILE_STARTUP:
+            startup_profile.extension_timings[name] = time.perf_counter() - start
+
+    def unload_extension(self, name):
+        super().unload_extension(name)
+        extension = name.rsplit('.', 1)[-1]
+        if extension in self.lazy_extensions:
+            self.add_stub_command(extension)
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        start = time.perf_counter()
+        try:
+            await super().invoke(ctx)
+        finally:
+            metrics.observe('command', ctx.command.qualified_name, time.perf_counter() - start, ctx.command_failed)
+
+    def add_listener(self, func, name=None):
+        name = func.__name__ if name is None else name
+        wrapper = metrics.timed_listener(func)
+        self.timed_listeners[(name, func)] = wrapper
+        super().add_listener(wrapper, name)
+
+    def remove_listener(self, func, name=None):
+        name = func.__name__ if name is None else name
+        super().remove_listener(self.timed_listeners.pop((name, func), func), name)
+
+    async def close(self):
+        await http_client.close()
+        await super().close()
+
+client = Bot(command_prefix = bot_config.DISCORD_PREFIX, intents=intents)
 
 @client.event
 async def on_ready():
     logging.info(f'Logged in as {client.user.name}, {client.user.id}')
     logging.info('-----------------------------------------')
     await client.change_presence(activity=discord.Game("Verifying 👀"))
+    if PROFILE_STARTUP:
+        startup_profile.log_report(STARTED)
 
 @client.command()
 @commands.is_owner()
@@ -54,7 +141,56 @@ async def reload(ctx, extension):
     await ctx.send('{} reloaded'.format(extension))
     logging.info(f'{extension} reloaded')
 
+@client.command()
+@commands.is_owner()
+async def dbstats(ctx):
+    """Show the shared MongoDB connection pool's statistics"""
+    stats = database.pool_stats.stats()
+    embed = discord.Embed(title="MongoDB connection pool")
+    embed.add_field(name="Open connections", value=f"{stats['open']} (max {stats['max_pool_size']})", inline=True)
+    embed.add_field(name="In use", value=stats['in_use'], inline=True)
+    embed.add_field(name="Checkouts", value=f"{stats['checked_out']} ({stats['checkout_failures']} failed)", inline=True)
+    embed.add_field(name="Connections created", value=stats['created'], inline=True)
+    await ctx.send(embed=embed)
+
+@client.command()
+@commands.is_owner()
+async def httpstats(ctx):
+    """Show request timings for each site the bot calls"""
+    embed = discord.Embed(title="HTTP requests")
+    for host, stats in http_client.stats().items():
+        embed.add_field(name=host, value=f"{stats['requests']} requests ({stats['errors']} failed)\n"
+                                         f"TTFB {stats['avg_ttfb_ms']:.0f} ms, total {stats['avg_total_ms']:.0f} ms avg, "
+                                         f"{stats['max_total_ms']:.0f} ms max", inline=False)
+    if not embed.fields:
+        embed.description = "No requests made yet"
+    await ctx.send(embed=embed)
+
+@client.command()
+@commands.is_owner()
+async def stats(ctx, count: int = 15):
+    """Show call counts and latency percentiles for the busiest commands and listeners"""
+    rows = metrics.summary()[:count]
+    if not rows:
+        await ctx.send(embed=discord.Embed(title="Stats", description="Nothing recorded yet"))
+        return
+    lines = [f"{'Name':<32} {'Calls':>7} {'Errors':>6} {'p50':>7} {'p95':>7} {'p99':>7}"]
+    for kind, name, calls, errors, p50, p95, p99 in rows:
+        label = f"!{name}" if kind == 'command' else name
+        lines.append(f"{label[:32]:<32} {calls:>7} {errors:>6} {p50 * 1000:>5.0f}ms {p95 * 1000:>5.0f}ms {p99 * 1000:>5.0f}ms")
+    await ctx.send(embed=discord.Embed(title="Stats", description="```\n" + "\n".join(lines) + "\n```"))
+
+if bot_config.METRICS_PORT:
+    client.loop.create_task(metrics.serve(bot_config.METRICS_PORT))
+
 for cog in conf['preloaded']:
     client.load_extension(f'unity_cogs.{cog}')
 
-client.run(bot_config.DISCORD_TOKEN)
+for cog, command_names in conf.get('lazy', {}).items():
+    client.add_lazy_extension(cog, command_names)
+
+try:
+    client.run(bot_config.DISCORD_TOKEN)
+finally:
+    database.close()
+    log_listener.stop()
@@ -1,4 +1,3 @@
-import httpx
 import discord
 from discord.ext import commands
 import urllib.parse
@@ -6,6 +5,8 @@ from urllib import parse
 import re
 from typing import Tuple
 from redbot.core.utils.menus import menu, prev_page, next_page
+from unity_util import http_client
+from unity_util.message_router import contains
 
 CUSTOM_CONTROLS = {"⬅️": prev_page, "➡️": next_page}
 
@@ -38,34 +39,33 @@ class Cex(commands.Cog):
 
     def __init__(self, client):
         self.client = client
+        self.route = self.client.router.add_route('cex_links', self.expand_cex_links, predicate=contains('https://uk.webuy.com/'))
+
+    def cog_unload(self):
+        self.client.router.remove_route(self.route)
 
     # Events
     @commands.Cog.listener()
     async def on_ready(self):
         print('Cex search cog online')
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        # we do not want the bot to reply to itself or other bots
-        if message.author.bot == True or message.author.id == self.client.user.id:
-            return
-
-        if 'https://uk.webuy.com/' in message.content.lower():
-            for word in message.content.lower().split(' '):
-                if not word.startswith('https://uk.webuy.com/'):
-                    continue
-                if parse.parse_qs(parse.urlsplit(word).query)['id'] == {}:
-                    continue
-                try:
-                    product_id = parse.parse_qs(parse.urlsplit(word).query)['id'][0]
-                except KeyError:
-                    continue
-                cex_search = await self.cex_search(product_id)
-                if not cex_search: # If no results
-                    continue
-                new_embed = self.make_cex_embed(cex_search[0])
-                await message.edit(suppress=True)
-                await message.channel.send(embed=new_embed)
+    async def expand_cex_links(self, message: discord.Message):
+        """Routed messages from members containing a CeX link"""
+        for word in message.content.lower().split(' '):
+            if not word.startswith('https://uk.webuy.com/'):
+                continue
+            if parse.parse_qs(parse.urlsplit(word).query)['id'] == {}:
+                continue
+            try:
+                product_id = parse.parse_qs(parse.urlsplit(word).query)['id'][0]
+            except KeyError:
+                continue
+            cex_search = await self.cex_search(product_id)
+            if not cex_search: # If no results
+                continue
+            new_embed = self.make_cex_embed(cex_search[0])
+            await message.edit(suppress=True)
+            await message.channel.send(embed=new_embed)
 
 # Commands
 
@@ -105,8 +105,7 @@ class Cex(commands.Cog):
         clean_search_term = urllib.parse.quote(search_term) # Clean up the search term for the url
         url = f'https://wss2.cex.uk.webuy.io/v3/boxes?q={clean_search_term}&firstRecord=1&count=50&sortOrder=desc'
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, headers=headers)
+        r = await http_client.get(url, headers=headers)
 
         if r.status_code != 200:
             return ()
@@ -1,6 +1,7 @@
 import discord
 from discord.ext import commands
 import httpx
+from unity_util import http_client
 import bs4
 from bs4 import BeautifulSoup as soup
 import datetime
@@ -101,8 +102,7 @@ class Ebay(commands.Cog):
         """Returns a BeautifulSoup object from an ebay search"""
         url = f"https://www.ebay.co.uk/sch/i.html?_from=R40&_nkw={search_term}&_sacat=0&rt=nc&LH_Sold=1&LH_Complete=1&_ipg=200&LH_ItemCondition=4&LH_PrefLoc=1"
 
-        async with httpx.AsyncClient() as client:
-            r = await client.get(url, headers=headers)
+        r = await http_client.get(url, headers=headers)
 
         if r.status_code != 200:
             return None
@@ -2,31 +2,28 @@ import discord
 from discord.ext import commands
 from unity_util import bot_config
 import logging
-import sys
 import random
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 
 class EmbedRemover(commands.Cog):
     def __init__(self, client):
         self.client = client
+        self.route = self.client.router.add_route('embed_remover', self.suppress_embeds,
+                                                  channel_id=bot_config.EMBED_REMOVER_CHANNEL_ID, ignore_bots=False)
+
+    def cog_unload(self):
+        self.client.router.remove_route(self.route)
 
     # Events
     @commands.Cog.listener()
     async def on_ready(self):
         logging.info('Embed remover cog online')
 
-    @commands.Cog.listener()
-    async def on_message(self, message: discord.message):
-        if message.channel.id == bot_config.EMBED_REMOVER_CHANNEL_ID:
-            try:
-                await message.edit(suppress=True)
-            except discord.Forbidden:
-                logging.warning(f"Did not have permission to remove embeds from {message.id} from {message.author}!")
+    async def suppress_embeds(self, message: discord.message):
+        try:
+            await message.edit(suppress=True)
+        except discord.Forbidden:
+            logging.warning(f"Did not have permission to remove embeds from {message.id} from {message.author}!")
 
 
 def setup(client):
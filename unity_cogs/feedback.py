@@ -1,43 +1,37 @@
 import discord
-import asyncio
-import sys
 import logging
 from discord.ext import commands
 from unity_util import bot_config
 
 green = 0x00ff00
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 class Feedback(commands.Cog):
 
     def __init__(self, client):
         self.client = client
+        self.route = self.client.router.add_route('feedback', self.add_vote_reactions,
+                                                  channel_id=bot_config.REACTION_CHANNEL_ID, ignore_bots=False)
+
+    def cog_unload(self):
+        self.client.router.remove_route(self.route)
 
     @commands.Cog.listener()
     async def on_ready(self):
         print('Feedback cog online')
 
-    @commands.Cog.listener()
-    async def on_message(self, message):
-        if message.channel.id == bot_config.REACTION_CHANNEL_ID and message.author.id != self.client.user.id:
+    async def add_vote_reactions(self, message):
+        if message.author.id != self.client.user.id:
             await message.add_reaction('👍')
             await message.add_reaction('👎')
 
-            def check(reaction, user):
-                for r in reaction.message.reactions:
-                    if r.emoji == '👍' and r.count - 1 >= bot_config.REACTION_THRESHOLD:
-                        return True
-                return False
-
-            try:
-                await self.client.wait_for('reaction_add', timeout=86400.0, check=check)
-                await self.send_feedback_embed(message)
-            except asyncio.TimeoutError:
-                return
+    @commands.Cog.listener()
+    async def on_reaction_add(self, reaction, user):
+        # Forward feedback once, as its upvotes (not counting the bot's own) reach the threshold
+        message = reaction.message
+        if message.channel.id != bot_config.REACTION_CHANNEL_ID or reaction.emoji != '👍':
+            return
+        if reaction.count - 1 == bot_config.REACTION_THRESHOLD:
+            await self.send_feedback_embed(message)
 
     async def send_feedback_embed(self, message):
         if message.author.id == self.client.user.id:
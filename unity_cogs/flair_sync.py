@@ -0,0 +1,323 @@
+import io
+import discord
+import asyncio
+import logging
+from datetime import datetime as dt
+from discord.ext import commands, tasks
+from unity_util import bot_config
+from unity_util import database
+from unity_util.trade_roles import TRADE_ROLES, ROLE_IDS, flair_from_text, highest_flair, trade_roles_of, with_trade_role
+
+# Users checked per scheduled run, so a full pass is spread out rather than hogging either API
+SYNC_CHUNK_SIZE = 200
+SYNC_INTERVAL_MINUTES = 15
+# Pause between Discord role edits
+ROLE_EDIT_INTERVAL_SECONDS = 1
+REPORT_LINES = 15
+
+class FlairSync(commands.Cog):
+    """Reconciles trade roles on Discord with trade flairs on Reddit.
+    Whichever side shows the higher trade count wins. Reddit changes go through the verify cog's flair worker.
+    The scheduled pass only reports what it would change unless FLAIR_SYNC_AUTO_APPLY is set."""
+
+    def __init__(self, client):
+        self.client = client
+        # Lowercased Reddit name -> raw flair text, fetched at the start of each scheduled pass
+        self.reddit_flairs = None
+        self.lock = asyncio.Lock()
+        self.scheduled_sync.start()
+
+    def cog_unload(self):
+        self.scheduled_sync.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        print('Flair sync cog online')
+
+# Commands
+
+    @commands.group()
+    @commands.is_owner()
+    async def flairsync(self, ctx):
+        """Reconcile trade roles and Reddit flairs"""
+        if ctx.invoked_subcommand is None:
+            pass
+
+    @flairsync.command()
+    async def report(self, ctx):
+        """Show what a full reconciliation would change, without changing anything"""
+        async with ctx.channel.typing():
+            fixes, skipped, checked = await self.compute_all_fixes()
+        await self.send_report(ctx, fixes, skipped, checked)
+
+    @flairsync.command()
+    async def run(self, ctx):
+        """Show a dry-run report, then apply it once confirmed"""
+        async with ctx.channel.typing():
+            fixes, skipped, checked = await self.compute_all_fixes()
+        await self.send_report(ctx, fixes, skipped, checked)
+        if not fixes:
+            return
+
+        message_object = await ctx.send('Apply these changes?')
+        emojis = ['✅', '❌']
+        for i in emojis:
+            await message_object.add_reaction(i)
+        def reaction_check(reaction, user):
+            return (user == ctx.author) and (reaction.message.id == message_object.id) and (reaction.emoji in emojis)
+        try:
+            reaction, user = await self.client.wait_for('reaction_add', timeout=120.0, check=reaction_check)
+        except asyncio.TimeoutError:
+            try:
+                await message_object.clear_reactions()
+            except:
+                pass
+            return
+        if reaction.emoji == '❌':
+            await message_object.clear_reactions()
+            return
+
+        async with self.lock:
+            results = await self.apply_fixes(fixes)
+        embed = discord.Embed(title="Flair sync complete")
+        embed.add_field(name="Reddit flairs fixed", value=f"{results['reddit_ok']} ({results['reddit_failed']} failed)", inline=True)
+        embed.add_field(name="Discord roles fixed", value=f"{results['discord_ok']} ({results['discord_failed']} failed)", inline=True)
+        await ctx.send(embed=embed)
+
+    @flairsync.command()
+    async def status(self, ctx):
+        """Show the progress of the scheduled reconciliation pass"""
+        state = await database.state.find_one({'_id': 'flair_sync'}) or {}
+        embed = discord.Embed(title="Scheduled flair sync")
+        embed.add_field(name="Mode", value="Apply fixes" if bot_config.FLAIR_SYNC_AUTO_APPLY else "Report only", inline=True)
+        embed.add_field(name="Pass in progress", value="Yes" if state.get('after') else "No", inline=True)
+        embed.add_field(name="Users checked this pass", value=state.get('checked', 0), inline=True)
+        embed.add_field(name="Fixes found this pass", value=state.get('found', 0), inline=True)
+        embed.add_field(name="Fixes applied this pass", value=state.get('fixed', 0), inline=True)
+        embed.add_field(name="Skipped this pass (custom flair)", value=state.get('skipped', 0), inline=True)
+        if state.get('completed_at'):
+            embed.set_footer(text=f"Last full pass finished {state['completed_at'].strftime('%d/%m/%Y %H:%M')} UTC")
+        await ctx.send(embed=embed)
+
+# Helper functions
+
+    def get_flair_worker(self):
+        verify = self.client.get_cog('Verify')
+        if verify is None:
+            raise RuntimeError("The verify cog must be loaded to sync flairs")
+        return verify.flair_worker
+
+    async def fetch_reddit_flairs(self) -> dict:
+        """Stream the subreddit's whole flair list in the flair worker's thread, keeping each user's raw flair text"""
+        worker = self.get_flair_worker()
+
+        def fetch():
+            return {str(i['user']).lower(): i['flair_text'] for i in worker.subreddit.flair(limit=None)}
+
+        return await self.client.loop.run_in_executor(worker.executor, fetch)
+
+    async def fetch_current_flairs(self, reddit_names: list) -> dict:
+        """Re-read a few users' flairs in the flair worker's thread, as fetch_reddit_flairs does for everyone"""
+        worker = self.get_flair_worker()
+
+        def fetch():
+            flairs = {}
+            for name in reddit_names:
+                flairs[name.lower()] = None
+                for i in worker.subreddit.flair(redditor=name):
+                    flairs[name.lower()] = i['flair_text']
+            return flairs
+
+        return await self.client.loop.run_in_executor(worker.executor, fetch)
+
+    def compute_fixes(self, users: list, reddit_flairs: dict):
+        """Compare users' Reddit flairs against their members' trade roles.
+        Users with a flair that isn't a trade flair, such as a mod flair, are skipped rather than overwritten."""
+        guild = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
+        fixes = []
+        skipped = []
+        for user in users:
+            reddit_name = user['reddit']['name']
+            flair_text = reddit_flairs.get(reddit_name.lower())
+            reddit_flair = flair_from_text(flair_text)
+            if flair_text and reddit_flair is None:
+                skipped.append({'discord_id': user['discord']['id'], 'reddit_name': reddit_name, 'flair_text': flair_text})
+                continue
+            member = guild.get_member(int(user['discord']['id']))
+            trade_roles = trade_roles_of(member.roles) if member else []
+            discord_flair = TRADE_ROLES[trade_roles[0].id] if trade_roles else None
+            target = highest_flair(reddit_flair, discord_flair)
+            if target is None:
+                continue
+
+            fix_reddit = reddit_flair != target
+            fix_discord = member is not None and (discord_flair != target or len(trade_roles) > 1)
+            if fix_reddit or fix_discord:
+                fixes.append({
+                    'discord_id': user['discord']['id'],
+                    'reddit_name': reddit_name,
+                    'reddit_flair': reddit_flair,
+                    'discord_flair': discord_flair,
+                    'target': target,
+                    'fix_reddit': fix_reddit,
+                    'fix_discord': fix_discord
+                })
+        return fixes, skipped
+
+    async def compute_all_fixes(self):
+        """Compute the fixes for every verified user, streaming users from the database"""
+        reddit_flairs = await self.fetch_reddit_flairs()
+        fixes = []
+        skipped = []
+        checked = 0
+        batch = []
+        async for user in database.users.find({}, {'discord.id': 1, 'reddit.name': 1}).batch_size(SYNC_CHUNK_SIZE):
+            batch.append(user)
+            if len(batch) >= SYNC_CHUNK_SIZE:
+                batch_fixes, batch_skipped = self.compute_fixes(batch, reddit_flairs)
+                fixes.extend(batch_fixes)
+                skipped.extend(batch_skipped)
+                checked += len(batch)
+                batch = []
+        batch_fixes, batch_skipped = self.compute_fixes(batch, reddit_flairs)
+        fixes.extend(batch_fixes)
+        skipped.extend(batch_skipped)
+        checked += len(batch)
+        return fixes, skipped, checked
+
+    async def apply_fixes(self, fixes: list) -> dict:
+        """Set Reddit flairs in bulk through the flair worker and Discord roles one member edit at a time"""
+        worker = self.get_flair_worker()
+        reddit_fixes = [i for i in fixes if i['fix_reddit']]
+        reddit_results = await asyncio.gather(*[
+            worker.set_flair(i['reddit_name'], f"{i['target']} Trades", css_class=f"{i['target']} Trades".replace("+", ""))
+            for i in reddit_fixes
+        ], return_exceptions=True)
+
+        guild = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
+        discord_ok = discord_failed = 0
+        for fix in fixes:
+            if not fix['fix_discord']:
+                continue
+            member = guild.get_member(int(fix['discord_id']))
+            if member is None:
+                continue
+            target_role = guild.get_role(ROLE_IDS[fix['target']])
+            try:
+                await member.edit(roles=with_trade_role(member.roles, target_role))
+                discord_ok += 1
+                logging.info(f"Flair sync: set trade role {fix['target']} for {member.name}#{member.discriminator}")
+            except discord.HTTPException as err:
+                discord_failed += 1
+                logging.error(f"ERROR SYNCING TRADE ROLE FOR {member.name}#{member.discriminator}: {err}")
+            await asyncio.sleep(ROLE_EDIT_INTERVAL_SECONDS)
+
+        reddit_ok = sum(1 for i in reddit_results if i is True)
+        return {
+            'reddit_ok': reddit_ok,
+            'reddit_failed': len(reddit_fixes) - reddit_ok,
+            'discord_ok': discord_ok,
+            'discord_failed': discord_failed
+        }
+
+    def report_lines(self, fixes: list, skipped: list) -> list:
+        lines = []
+        for fix in fixes:
+            changes = []
+            if fix['fix_reddit']:
+                changes.append(f"Reddit {fix['reddit_flair'] or 'none'} → {fix['target']}")
+            if fix['fix_discord']:
+                changes.append(f"Discord {fix['discord_flair'] or 'none'} → {fix['target']}")
+            lines.append(f"u/{fix['reddit_name']} ({fix['discord_id']}): {', '.join(changes)}")
+        for skip in skipped:
+            lines.append(f"u/{skip['reddit_name']} ({skip['discord_id']}): skipped, custom flair \"{skip['flair_text']}\"")
+        return lines
+
+    async def send_report(self, ctx, fixes: list, skipped: list, checked: int):
+        lines = self.report_lines(fixes, skipped)
+
+        embed = discord.Embed(title="Flair sync report (dry run)")
+        embed.add_field(name="Users checked", value=checked, inline=True)
+        embed.add_field(name="Reddit flairs to fix", value=sum(1 for i in fixes if i['fix_reddit']), inline=True)
+        embed.add_field(name="Discord roles to fix", value=sum(1 for i in fixes if i['fix_discord']), inline=True)
+        embed.add_field(name="Skipped (custom flair)", value=len(skipped), inline=True)
+        if lines:
+            embed.description = "\n".join(lines[:REPORT_LINES]).replace('_', '\\_')
+        if len(lines) > REPORT_LINES:
+            report = discord.File(io.BytesIO("\n".join(lines).encode()), filename="flair_sync_report.txt")
+            await ctx.send(embed=embed, file=report)
+        else:
+            await ctx.send(embed=embed)
+
+# Tasks
+
+    @tasks.loop(minutes=SYNC_INTERVAL_MINUTES)
+    async def scheduled_sync(self):
+        """Reconcile the next chunk of users, resuming from the checkpoint saved by the last run"""
+        async with self.lock:
+            try:
+                state = await database.state.find_one({'_id': 'flair_sync'}) or {}
+                after = state.get('after')
+                if after is None or self.reddit_flairs is None:
+                    self.reddit_flairs = await self.fetch_reddit_flairs()
+
+                query = {'_id': {'$gt': after}} if after is not None else {}
+                users = await database.users.find(query, {'discord.id': 1, 'reddit.name': 1}).sort('_id', 1).limit(SYNC_CHUNK_SIZE).to_list(length=SYNC_CHUNK_SIZE)
+                fixes, skipped = self.compute_fixes(users, self.reddit_flairs)
+                if fixes and bot_config.FLAIR_SYNC_AUTO_APPLY:
+                    # The pass's flair list may be hours old by now. Recheck against the users' current flairs,
+                    # or a downgrade made with !editflair since would be reverted as the lower rank.
+                    self.reddit_flairs.update(await self.fetch_current_flairs([i['reddit_name'] for i in fixes]))
+                    fixes, skipped = self.compute_fixes(users, self.reddit_flairs)
+                applied = 0
+                if fixes and bot_config.FLAIR_SYNC_AUTO_APPLY:
+                    await self.apply_fixes(fixes)
+                    applied = len(fixes)
+                else:
+                    for line in self.report_lines(fixes, skipped):
+                        logging.info(f"Flair sync (dry run): {line}")
+
+                def total(key, count):
+                    return (state.get(key, 0) if after is not None else 0) + count
+
+                done = len(users) < SYNC_CHUNK_SIZE
+                update = {
+                    'after': None if done else users[-1]['_id'],
+                    'checked': total('checked', len(users)),
+                    'found': total('found', len(fixes)),
+                    'fixed': total('fixed', applied),
+                    'skipped': total('skipped', len(skipped))
+                }
+                if done:
+                    update['completed_at'] = dt.utcnow()
+                    self.reddit_flairs = None
+                    logging.info(f"Flair sync pass complete: {update['checked']} users checked, {update['found']} fixes found, "
+                                 f"{update['fixed']} applied, {update['skipped']} skipped")
+                    await self.send_pass_summary(update)
+                await database.state.update_one({'_id': 'flair_sync'}, {'$set': update}, upsert=True)
+            except Exception as err:
+                logging.error(f"ERROR SYNCING FLAIRS: {err}")
+
+    async def send_pass_summary(self, update: dict):
+        """Post the totals of a finished scheduled pass; the lines for each fix are in the log"""
+        channel = self.client.get_channel(bot_config.REPORT_CHANNEL_ID)
+        if channel is None:
+            return
+        mode = "applied" if bot_config.FLAIR_SYNC_AUTO_APPLY else "dry run, nothing changed"
+        embed = discord.Embed(title=f"Scheduled flair sync pass complete ({mode})")
+        embed.add_field(name="Users checked", value=update['checked'], inline=True)
+        embed.add_field(name="Fixes found", value=update['found'], inline=True)
+        embed.add_field(name="Fixes applied", value=update['fixed'], inline=True)
+        embed.add_field(name="Skipped (custom flair)", value=update['skipped'], inline=True)
+        embed.set_footer(text="Run !flairsync report for the full list, or !flairsync run to apply it")
+        try:
+            await channel.send(embed=embed)
+        except discord.HTTPException as err:
+            logging.error(f"ERROR SENDING FLAIR SYNC SUMMARY: {err}")
+
+    @scheduled_sync.before_loop
+    async def before_scheduled_sync(self):
+        await self.client.wait_until_ready()
+
+def setup(client):
+    client.add_cog(FlairSync(client))
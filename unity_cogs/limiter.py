@@ -1,60 +1,129 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ext.commands import has_permissions
 import datetime
 import humanize
+from pymongo import UpdateOne
 from unity_util import bot_config
+from unity_util import database
+from unity_util.near_duplicates import NearDuplicateIndex, make_signature
 import logging
 import asyncio
-import sys
+import heapq
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
+# How long to collect undeliverable DMs before mentioning them in the backup channel in one go
+FALLBACK_BATCH_SECONDS = 5
+# Discord's message length limit, used when splitting batched fallback mentions
+MAX_MESSAGE_LENGTH = 2000
 
 class Limiter(commands.Cog):
     def __init__(self, client):
         self.client = client
-        self.whitelisted_users = []
+        # Member ID -> whitelist expiry time, with a min-heap of (expiry, member ID) for the sweeper.
+        # Revoked or extended grants leave stale heap entries behind which are skipped when popped.
+        self.whitelisted_users = {}
+        self.whitelist_expiries = []
+        self.whitelist_changed = asyncio.Event()
+        self.sweep_whitelist_task = self.client.loop.create_task(self.sweep_whitelist())
+        # Author ID -> (message ID, creation time) of their most recent post in the buy-sell channel,
+        # author ID -> their earlier posts seen since the bot started, oldest first, to fall back on if the latest is deleted,
+        # and message ID -> author ID for all of those posts so deletions can be looked up directly
+        self.last_posts = {}
+        self.earlier_posts = {}
+        self.last_post_authors = {}
+        self.index_ready = asyncio.Event()
+        self.duplicate_index = NearDuplicateIndex(max_age=datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS),
+                                                  threshold=bot_config.BUY_SELL_DUPLICATE_THRESHOLD)
+        self.build_index_task = self.client.loop.create_task(self.build_index())
+        self.prune_index.start()
+        # Author IDs waiting for a removal notification, with the latest notification for each author.
+        # Repeat removals for an author who hasn't been notified yet replace the pending notification.
+        self.notification_queue = asyncio.Queue()
+        self.pending_notifications = {}
+        self.failed_notifications = []
+        self.flush_fallback_task = None
+        self.deliver_notifications_task = self.client.loop.create_task(self.deliver_notifications())
+        # Every post has to be checked, so the route queues through spam waves and the startup backfill instead of dropping posts
+        self.route = self.client.router.add_route('limiter', self.check_post, channel_id=bot_config.BUY_SELL_CHANNEL_ID,
+                                                  max_pending=1000, shed_load=False)
+
+    def cog_unload(self):
+        self.client.router.remove_route(self.route)
+        self.build_index_task.cancel()
+        self.deliver_notifications_task.cancel()
+        if self.flush_fallback_task is not None:
+            self.flush_fallback_task.cancel()
+        self.sweep_whitelist_task.cancel()
+        self.prune_index.cancel()
 
     # Events
     @commands.Cog.listener()
     async def on_ready(self):
         print('Buy-sell-trade post limiter cog online')
 
+    async def check_post(self, message: discord.Message):
+        """Routed every buy-sell post from a member, bots are already filtered out"""
+        author = message.author
+        content = message.content # Save this
+        await self.index_ready.wait()
+        last_post = self.last_posts.get(author.id)
+        if author.id in self.whitelisted_users or not self.is_limited(message, last_post):
+            if not await self.check_duplicate(message):
+                await self.record_post(message)
+                # Let other cogs act on posts that made it through the limiter
+                self.client.dispatch('buy_sell_post', message)
+            return
+
+        deletion_success = False
+        try:
+            logging.info(f"Deleting message {message.id} from {author.id}")
+            await message.delete()
+            deletion_success = True
+        except discord.Forbidden:
+            logging.warning(f"Did not have permission to delete message {message.id} from {author}!")
+        except discord.NotFound:
+            logging.info(f"Message {message.id} from {author.id} was already deleted")
+        except discord.HTTPException as e:
+            logging.error(f"Failed to delete message {message.id} from {author.id} : {e}")
+
+        if deletion_success:
+            self.queue_info_message(author, message.channel.id, content, last_post[1])
+
     @commands.Cog.listener()
-    async def on_message(self, message: discord.Message):
-        # we do not want the bot to reply to itself or other bots
-        if message.author.bot == True or message.author.id == self.client.user.id:
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id != bot_config.BUY_SELL_CHANNEL_ID:
             return
 
-        # Only read messages in the right channel
-        if message.channel.id != bot_config.BUY_SELL_CHANNEL_ID:
+        self.duplicate_index.remove(payload.message_id)
+
+        author_id = self.last_post_authors.pop(payload.message_id, None)
+        if author_id is None:
             return
 
-        author = message.author
-        if author.id in self.whitelisted_users:
+        if self.last_posts[author_id][0] != payload.message_id:
+            self.earlier_posts[author_id] = [i for i in self.earlier_posts[author_id] if i[0] != payload.message_id]
+            if not self.earlier_posts[author_id]:
+                del self.earlier_posts[author_id]
             return
-        content = message.content # Save this
-        time_limit = datetime.datetime.now() - datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
-        messages = await message.channel.history(after=time_limit).flatten()
-        for past_message in messages:
-            if past_message.author == author and past_message.id != message.id:
-                deletion_success = False
-                try:
-                    logging.info(f"Deleting message {message.id} from {author.id}")
-                    await message.delete()
-                    deletion_success = True
-                except discord.Forbidden:
-                    logging.warning(f"Did not have permission to delete message {message.id} from {author}!")
-                except discord.NotFound:
-                    logging.info(f"Message {message.id} from {author.id} was already deleted")
-                except discord.HTTPException as e:
-                    logging.error(f"Failed to delete message {message.id} from {author.id} : {e}")
-
-                if deletion_success:
-                    await self.send_info_message(author, message.channel.id, content, past_message.created_at)
+
+        # Deleting their latest post leaves them limited by the one before it, as the history scan did.
+        # Once that has aged out, or if the bot hasn't seen it, they are free to post again.
+        earlier = self.earlier_posts.get(author_id)
+        try:
+            if earlier:
+                message_id, created_at = self.last_posts[author_id] = earlier.pop()
+                if not earlier:
+                    del self.earlier_posts[author_id]
+                await database.limiter_posts.update_one(
+                    {"_id": str(author_id)},
+                    {"$set": {"message_id": str(message_id), "created_at": created_at}},
+                    upsert=True
+                )
+            else:
+                del self.last_posts[author_id]
+                await database.limiter_posts.delete_one({"_id": str(author_id), "message_id": str(payload.message_id)})
+        except Exception as err:
+            logging.error(f"ERROR REMOVING LAST POST FOR {author_id}: {err}")
 
     @commands.group()
     @has_permissions(manage_roles=True)
@@ -68,28 +137,230 @@ class Limiter(commands.Cog):
         desc = f"{member.mention} you can now post in <#{bot_config.BUY_SELL_CHANNEL_ID}> for {str(datetime.timedelta(seconds=int(seconds)))}"
         embed = discord.Embed(title=f"Whitelisted user", description=desc, colour=member.colour)
         await ctx.send(embed=embed)
-        self.whitelisted_users.append(member.id)
-        await asyncio.sleep(seconds)
+        expires_at = datetime.datetime.utcnow() + datetime.timedelta(seconds=seconds)
+        self.add_to_whitelist(member.id, expires_at)
+        try:
+            await database.limiter_whitelist.update_one({"_id": str(member.id)}, {"$set": {"expires_at": expires_at}}, upsert=True)
+        except Exception as err:
+            logging.error(f"ERROR SAVING WHITELIST FOR {member.id}: {err}")
+
+    @limiter.command(name='list')
+    async def list_whitelist(self, ctx):
+        """Lists users who are currently whitelisted"""
+        now = datetime.datetime.utcnow()
+        grants = sorted((expires_at, member_id) for member_id, expires_at in self.whitelisted_users.items() if expires_at > now)
+        if not grants:
+            embed = discord.Embed(description="No users are currently whitelisted", colour=ctx.guild.me.colour)
+            await ctx.send(embed=embed)
+            return
+
+        lines = [f"<@{member_id}> - {humanize.naturaldelta(expires_at - now)} left" for expires_at, member_id in grants]
+        desc = ""
+        for i, line in enumerate(lines):
+            if len(desc) + len(line) > 1900:
+                desc += f"...and {len(lines) - i} more"
+                break
+            desc += line + "\n"
+        embed = discord.Embed(title="Whitelisted users", description=desc, colour=ctx.guild.me.colour)
+        await ctx.send(embed=embed)
+
+    @limiter.command()
+    async def revoke(self, ctx, member: discord.Member):
+        """Removes a user from the buy-sell-trade whitelist"""
+        if self.whitelisted_users.pop(member.id, None) is None:
+            embed = discord.Embed(description=f"{member.mention} is not whitelisted", colour=ctx.guild.me.colour)
+            await ctx.send(embed=embed)
+            return
+
+        try:
+            await database.limiter_whitelist.delete_one({"_id": str(member.id)})
+        except Exception as err:
+            logging.error(f"ERROR REMOVING WHITELIST FOR {member.id}: {err}")
+        embed = discord.Embed(title="Whitelist revoked", description=f"{member.mention} is no longer whitelisted", colour=member.colour)
+        await ctx.send(embed=embed)
+
+    def add_to_whitelist(self, member_id: int, expires_at: datetime.datetime):
+        """Whitelist a member until the given time and wake the sweeper if this is the new earliest expiry"""
+        self.whitelisted_users[member_id] = expires_at
+        heapq.heappush(self.whitelist_expiries, (expires_at, member_id))
+        if self.whitelist_expiries[0] == (expires_at, member_id):
+            self.whitelist_changed.set()
+
+    async def sweep_whitelist(self):
+        """Load persisted whitelist grants, then expire them as they come due"""
+        try:
+            await database.limiter_whitelist.create_index("expires_at", expireAfterSeconds=0)
+            async for document in database.limiter_whitelist.find({"expires_at": {"$gt": datetime.datetime.utcnow()}}):
+                self.add_to_whitelist(int(document['_id']), document['expires_at'])
+            logging.info(f"Loaded {len(self.whitelisted_users)} whitelisted users")
+        except Exception as err:
+            logging.error(f"ERROR LOADING WHITELIST: {err}")
+
+        while True:
+            self.whitelist_changed.clear()
+            now = datetime.datetime.utcnow()
+            while self.whitelist_expiries and self.whitelist_expiries[0][0] <= now:
+                expires_at, member_id = heapq.heappop(self.whitelist_expiries)
+                if self.whitelisted_users.get(member_id) == expires_at:
+                    del self.whitelisted_users[member_id]
+
+            timeout = (self.whitelist_expiries[0][0] - now).total_seconds() if self.whitelist_expiries else None
+            try:
+                await asyncio.wait_for(self.whitelist_changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    def is_limited(self, message: discord.Message, last_post: tuple) -> bool:
+        """Check whether a message was posted within the limit of the author's last post"""
+        if last_post is None or last_post[0] == message.id:
+            return False
+        return message.created_at - last_post[1] < datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
+
+    def set_last_post(self, author_id: int, message_id: int, created_at: datetime.datetime):
+        """Make a post an author's most recent, keeping the one it replaces as an earlier post"""
+        previous = self.last_posts.get(author_id)
+        if previous is not None and previous[0] != message_id:
+            self.earlier_posts.setdefault(author_id, []).append(previous)
+        self.last_posts[author_id] = (message_id, created_at)
+        self.last_post_authors[message_id] = author_id
+
+    async def record_post(self, message: discord.Message):
+        """Store a message as its author's most recent post"""
+        self.set_last_post(message.author.id, message.id, message.created_at)
         try:
-            self.whitelisted_users.remove(member.id)
-        except ValueError:
-            logging.warning(f"User {member.id} already removed from whitelist")
+            await database.limiter_posts.update_one(
+                {"_id": str(message.author.id)},
+                {"$set": {"message_id": str(message.id), "created_at": message.created_at}},
+                upsert=True
+            )
+        except Exception as err:
+            logging.error(f"ERROR SAVING LAST POST FOR {message.author.id}: {err}")
+
+    def index_duplicate_signature(self, message: discord.Message, signature: tuple = None):
+        """Add a post to the near-duplicate index"""
+        if bot_config.BUY_SELL_DUPLICATE_ACTION == "off":
+            return
+        signature = signature or make_signature(message.content)
+        if signature is not None:
+            self.duplicate_index.add(message.id, message.author.id, signature, message.created_at)
+
+    async def check_duplicate(self, message: discord.Message) -> bool:
+        """Flag or remove a post that is a near-duplicate of another user's recent post.
+        Returns True if the post was removed."""
+        if bot_config.BUY_SELL_DUPLICATE_ACTION == "off":
+            return False
+
+        signature = make_signature(message.content)
+        if signature is None:
+            return False
+
+        match = self.duplicate_index.find(signature, message.author.id, message.created_at)
+        if match is None:
+            self.index_duplicate_signature(message, signature)
+            return False
 
-    async def make_embed(self, author: discord.Member, deleted_content: str) -> discord.Embed:
-        user = await self.client.fetch_user(author.id)
+        original_id, original_author_id, score = match
+        removed = False
+        if bot_config.BUY_SELL_DUPLICATE_ACTION == "remove":
+            try:
+                logging.info(f"Deleting message {message.id} from {message.author.id} as a repost of {original_id}")
+                await message.delete()
+                removed = True
+            except discord.HTTPException as e:
+                logging.error(f"Failed to delete repost {message.id} from {message.author.id} : {e}")
+
+        if not removed:
+            self.index_duplicate_signature(message, signature)
+        await self.report_duplicate(message, original_id, original_author_id, score, removed)
+        return removed
+
+    async def report_duplicate(self, message: discord.Message, original_id: int, original_author_id: int, score: float, removed: bool):
+        report_channel = self.client.get_channel(bot_config.REPORT_CHANNEL_ID)
+        if report_channel is None:
+            logging.warning(f"Limiter: failed to fetch report channel with ID {bot_config.REPORT_CHANNEL_ID}")
+            return
+
+        title = "Repost from another user removed" if removed else "Possible repost from another user"
+        embed = discord.Embed(title=title, description=message.content, colour=discord.Colour.orange())
+        embed.add_field(name="Author", value=message.author.mention)
+        embed.add_field(name="Original author", value=f"<@{original_author_id}>")
+        embed.add_field(name="Similarity", value=f"{score:.0%}")
+        embed.add_field(name="Original post", value=f"[Here!](https://discord.com/channels/{message.guild.id}/{message.channel.id}/{original_id})")
+        if not removed:
+            embed.add_field(name="Repost", value=f"[Here!]({message.jump_url})")
+        try:
+            await report_channel.send(embed=embed)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to report repost {message.id}: {e}")
+
+    async def build_index(self):
+        """Seed the last post index from the database, then backfill anything posted while the bot was offline"""
+        await self.client.wait_until_ready()
+        try:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
+            backfill_from = cutoff
+            try:
+                await database.limiter_posts.create_index("created_at", expireAfterSeconds=bot_config.BUY_SELL_LIMIT_SECONDS)
+                async for document in database.limiter_posts.find({"created_at": {"$gt": cutoff}}):
+                    self.set_last_post(int(document['_id']), int(document['message_id']), document['created_at'])
+                    backfill_from = max(backfill_from, document['created_at'])
+            except Exception as err:
+                logging.error(f"ERROR LOADING LIMITER INDEX: {err}")
+
+            channel = self.client.get_channel(bot_config.BUY_SELL_CHANNEL_ID)
+            if channel is None:
+                logging.warning(f"Limiter: failed to fetch buy-sell channel with ID {bot_config.BUY_SELL_CHANNEL_ID}")
+                return
+
+            # History is returned oldest first, so later posts overwrite earlier ones
+            backfilled = {}
+            async for message in channel.history(limit=None, after=backfill_from):
+                if message.author.bot:
+                    continue
+                backfilled[message.author.id] = (message.id, message.created_at)
+                self.index_duplicate_signature(message)
+            for author_id, (message_id, created_at) in backfilled.items():
+                self.set_last_post(author_id, message_id, created_at)
+
+            if backfilled:
+                await database.limiter_posts.bulk_write([
+                    UpdateOne({"_id": str(author_id)}, {"$set": {"message_id": str(message_id), "created_at": created_at}}, upsert=True)
+                    for author_id, (message_id, created_at) in backfilled.items()
+                ])
+            logging.info(f"Limiter index built with {len(self.last_posts)} authors ({len(backfilled)} backfilled from history)")
+        except Exception as err:
+            logging.error(f"ERROR BUILDING LIMITER INDEX: {err}")
+        finally:
+            self.index_ready.set()
+
+    def make_embed(self, author: discord.Member, deleted_content: str) -> discord.Embed:
         embed = discord.Embed(description=deleted_content, colour=author.colour)
-        if author.avatar is None:
-            embed.set_author(name=author.display_name, icon_url = f"https://cdn.discordapp.com/embed/avatars/{user.discriminator}.png")
-        else:
-            embed.set_author(name=author.display_name, icon_url = f"https://cdn.discordapp.com/avatars/{author.id}/{author.avatar}.png")
+        # avatar_url falls back to the default avatar from the cached member, so no user fetch is needed
+        embed.set_author(name=author.display_name, icon_url=str(author.avatar_url_as(format='png')))
         return embed
 
-    async def send_info_message(self, author: discord.Member, channel_id: int, deleted_content: str, creation_time: datetime):
-        if author.dm_channel is None:
-            await author.create_dm()
+    def queue_info_message(self, author: discord.Member, channel_id: int, deleted_content: str, creation_time: datetime):
+        """Queue a removal notification for the delivery task"""
+        if author.id not in self.pending_notifications:
+            self.notification_queue.put_nowait(author.id)
+        self.pending_notifications[author.id] = (author, channel_id, deleted_content, creation_time)
 
-        dm_channel = author.dm_channel
+    async def deliver_notifications(self):
+        """Deliver removal notifications in the background, one request at a time.
+        discord.py holds each request until its route's rate limit bucket allows it,
+        so sending sequentially keeps a spam wave from piling up requests on the same buckets."""
+        await self.client.wait_until_ready()
+        while True:
+            author_id = await self.notification_queue.get()
+            notification = self.pending_notifications.pop(author_id, None)
+            if notification is None:
+                continue
+            try:
+                await self.send_info_message(*notification)
+            except Exception as err:
+                logging.error(f"ERROR NOTIFYING {author_id} OF REMOVED POST: {err}")
 
+    async def send_info_message(self, author: discord.Member, channel_id: int, deleted_content: str, creation_time: datetime):
         limit_timestamp = datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
         post_again_formatted_time = (creation_time + limit_timestamp).strftime("%d/%m/%Y %I:%M:%S %p")
 
@@ -97,14 +368,62 @@ class Limiter(commands.Cog):
         content += f"\nYou may post again at {post_again_formatted_time}."
         content += "\n\nBelow is the message you tried to send:"
 
-        embed = await self.make_embed(author, deleted_content)
+        embed = self.make_embed(author, deleted_content)
 
         try:
+            dm_channel = author.dm_channel or await author.create_dm()
             await dm_channel.send(content, embed=embed)
-        except: # If the bot can't DM the user
-            backup_channel = self.client.get_channel(bot_config.BUY_SELL_BACKUP_DM_CHANNEL_ID)
-            content = f"<@{author.id}> {content}"
-            await backup_channel.send(content=content, embed=embed)
+        except discord.HTTPException: # If the bot can't DM the user
+            # A flush takes the whole list before sending, so an empty list means no flush is waiting to pick this up
+            if not self.failed_notifications:
+                self.flush_fallback_task = self.client.loop.create_task(self.flush_failed_notifications(channel_id))
+            self.failed_notifications.append((author, content, embed, post_again_formatted_time))
+
+    async def flush_failed_notifications(self, channel_id: int):
+        """Mention everyone whose DM failed within the batch window in the backup channel"""
+        await asyncio.sleep(FALLBACK_BATCH_SECONDS)
+        failed, self.failed_notifications = self.failed_notifications, []
+
+        backup_channel = self.client.get_channel(bot_config.BUY_SELL_BACKUP_DM_CHANNEL_ID)
+        if backup_channel is None:
+            logging.warning(f"Limiter: failed to fetch backup DM channel with ID {bot_config.BUY_SELL_BACKUP_DM_CHANNEL_ID}")
+            return
+
+        try:
+            if len(failed) == 1:
+                author, content, embed, _ = failed[0]
+                await backup_channel.send(content=f"<@{author.id}> {content}", embed=embed)
+                return
+
+            limit_timestamp = datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
+            content = f"Posts from the following users in <#{channel_id}> have been removed due to being within {humanize.naturaldelta(limit_timestamp)} of their last post:"
+            for author, _, _, post_again_formatted_time in failed:
+                line = f"\n<@{author.id}> may post again at {post_again_formatted_time}."
+                if len(content) + len(line) > MAX_MESSAGE_LENGTH:
+                    await backup_channel.send(content=content)
+                    content = ""
+                content += line
+            await backup_channel.send(content=content)
+        except discord.HTTPException as e:
+            logging.error(f"Failed to send removal notifications to the backup channel: {e}")
+
+    # Tasks
+
+    @tasks.loop(hours=1)
+    async def prune_index(self):
+        """Drop index entries that have aged out of the limit"""
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=bot_config.BUY_SELL_LIMIT_SECONDS)
+        expired = [author_id for author_id, (_, created_at) in self.last_posts.items() if created_at < cutoff]
+        for author_id in expired:
+            message_id, _ = self.last_posts.pop(author_id)
+            self.last_post_authors.pop(message_id, None)
+        for author_id, posts in list(self.earlier_posts.items()):
+            for message_id, _ in (i for i in posts if i[1] < cutoff):
+                self.last_post_authors.pop(message_id, None)
+            posts[:] = [i for i in posts if i[1] >= cutoff]
+            if not posts:
+                del self.earlier_posts[author_id]
+        self.duplicate_index.evict(datetime.datetime.utcnow())
 
 def setup(client):
     client.add_cog(Limiter(client))
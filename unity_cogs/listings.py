@@ -0,0 +1,146 @@
+import discord
+import datetime
+import humanize
+import logging
+from discord.ext import commands, tasks
+from pymongo import ReplaceOne
+from unity_util import bot_config
+from unity_util import database
+from unity_util.listing_index import ListingIndex, parse_listing
+
+# Listings are written to the database in batches of this size when backfilling from history
+BACKFILL_BATCH_SIZE = 100
+MAX_RESULTS = 10
+
+def make_record(message: discord.Message) -> dict:
+    record = parse_listing(message.content)
+    record.update({
+        '_id': str(message.id),
+        'author': str(message.author.id),
+        'created_at': message.created_at,
+        'jump_url': message.jump_url
+    })
+    return record
+
+class Listings(commands.Cog):
+    """Searchable index of recent buy-sell posts.
+    Relies on the limiter cog, which dispatches buy_sell_post for every post it lets through."""
+
+    def __init__(self, client):
+        self.client = client
+        self.index = ListingIndex(max_age=datetime.timedelta(seconds=bot_config.LISTINGS_MAX_AGE_SECONDS))
+        self.build_index_task = self.client.loop.create_task(self.build_index())
+        self.prune_index.start()
+
+    def cog_unload(self):
+        self.build_index_task.cancel()
+        self.prune_index.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        print('Listings cog online')
+
+    @commands.Cog.listener()
+    async def on_buy_sell_post(self, message: discord.Message):
+        record = make_record(message)
+        self.index.add(record)
+        await self.save_record(record)
+
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        record = self.index.records.get(str(payload.message_id))
+        if record is None or 'content' not in payload.data:
+            return
+        record = dict(record, **parse_listing(payload.data['content']))
+        self.index.update(record)
+        await self.save_record(record)
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        if payload.channel_id != bot_config.BUY_SELL_CHANNEL_ID:
+            return
+        self.index.remove(str(payload.message_id))
+        try:
+            await database.listings.delete_one({'_id': str(payload.message_id)})
+        except Exception as err:
+            logging.error(f"ERROR REMOVING LISTING {payload.message_id}: {err}")
+
+# Commands
+
+    @commands.command()
+    async def listings(self, ctx, *, terms: str):
+        """Search recent buy-sell posts"""
+        results = self.index.search(terms, limit=MAX_RESULTS)
+        if not results:
+            embed = discord.Embed(description=f"No recent listings found for `{terms.replace('`', '``')}`", colour=ctx.me.colour)
+            embed.set_author(name="No results 🙁")
+            await ctx.send(embed=embed)
+            return
+
+        embed = discord.Embed(title=f"Recent listings for {terms[:200]}", colour=ctx.me.colour)
+        now = datetime.datetime.utcnow()
+        for record in results:
+            have = record['have'] if len(record['have']) <= 200 else record['have'][:197] + "..."
+            value = f"<@{record['author']}> - {humanize.naturaltime(now - record['created_at'])} - [Jump]({record['jump_url']})"
+            if record['prices']:
+                value = " / ".join("£{:,.2f}".format(i) for i in record['prices']) + " - " + value
+            if record['want']:
+                value = f"**Wants:** {record['want'][:100]}\n" + value
+            embed.add_field(name=have or "(no text)", value=value, inline=False)
+        await ctx.send(embed=embed)
+
+# Helper functions
+
+    async def save_record(self, record: dict):
+        try:
+            await database.listings.replace_one({'_id': record['_id']}, record, upsert=True)
+        except Exception as err:
+            logging.error(f"ERROR SAVING LISTING {record['_id']}: {err}")
+
+    async def build_index(self):
+        """Load stored listings, then stream anything posted while the bot was offline from history in batches"""
+        await self.client.wait_until_ready()
+        try:
+            cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=bot_config.LISTINGS_MAX_AGE_SECONDS)
+            backfill_from = cutoff
+            try:
+                await database.listings.create_index('created_at', expireAfterSeconds=bot_config.LISTINGS_MAX_AGE_SECONDS)
+                async for record in database.listings.find({'created_at': {'$gt': cutoff}}).sort('created_at', 1).batch_size(500):
+                    self.index.add(record)
+                    backfill_from = max(backfill_from, record['created_at'])
+            except Exception as err:
+                logging.error(f"ERROR LOADING LISTINGS: {err}")
+
+            channel = self.client.get_channel(bot_config.BUY_SELL_CHANNEL_ID)
+            if channel is None:
+                logging.warning(f"Listings: failed to fetch buy-sell channel with ID {bot_config.BUY_SELL_CHANNEL_ID}")
+                return
+
+            batch = []
+            backfilled = 0
+            async for message in channel.history(limit=None, after=backfill_from):
+                if message.author.bot:
+                    continue
+                record = make_record(message)
+                self.index.add(record)
+                batch.append(ReplaceOne({'_id': record['_id']}, record, upsert=True))
+                if len(batch) >= BACKFILL_BATCH_SIZE:
+                    await database.listings.bulk_write(batch, ordered=False)
+                    backfilled += len(batch)
+                    batch = []
+            if batch:
+                await database.listings.bulk_write(batch, ordered=False)
+                backfilled += len(batch)
+            logging.info(f"Listing index built with {len(self.index)} listings ({backfilled} backfilled from history)")
+        except Exception as err:
+            logging.error(f"ERROR BUILDING LISTING INDEX: {err}")
+
+# Tasks
+
+    @tasks.loop(hours=1)
+    async def prune_index(self):
+        """Drop listings that have aged out"""
+        self.index.evict(datetime.datetime.utcnow())
+
+def setup(client):
+    client.add_cog(Listings(client))
@@ -1,9 +1,8 @@
 import discord
 from discord.ext import commands
-import httpx
 import logging
-import sys
 from unity_util import bot_config
+from unity_util import http_client
 from datetime import datetime as dt
 from colour import Color as Colour
 from redbot.core.utils.menus import menu, prev_page, next_page
@@ -11,11 +10,6 @@ from redbot.core.utils.menus import menu, prev_page, next_page
 CUSTOM_CONTROLS = {"⬅️": prev_page, "➡️": next_page}
 
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 class OdometerReading:
     def __init__(self, value: str, unit: str):
         self.value: int = int(value)
@@ -81,9 +75,8 @@ class Vehicle:
 async def get_vehicle(registration: str) -> Vehicle:
     headers = {'x-api-key': bot_config.DVLA_API_KEY}
     url = f'https://beta.check-mot.service.gov.uk/trade/vehicles/mot-tests/?registration={registration}'
-    async with httpx.AsyncClient() as client:
-        data = await client.get(url, headers=headers)
-        json = data.json()
+    data = await http_client.get(url, headers=headers)
+    json = data.json()
 
     if 'httpStatus' in json: # 404
         return None
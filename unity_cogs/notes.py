@@ -1,11 +1,9 @@
 import discord
 import asyncio
-import sys
 import logging
 from discord.ext import commands
 from discord.ext.commands import has_permissions
-from unity_util import bot_config
-import motor.motor_asyncio
+from unity_util import database
 import time
 from datetime import datetime as dt
 import random
@@ -15,15 +13,6 @@ from redbot.core.utils.menus import menu, prev_page, next_page
 
 CUSTOM_CONTROLS = {"⬅️": prev_page, "➡️": next_page}
 
-mongo = motor.motor_asyncio.AsyncIOMotorClient(host=bot_config.MONGODB_HOST, port=int(
-    bot_config.MONGODB_PORT), replicaSet="rs01", username=bot_config.MONGODB_USERNAME, password=bot_config.MONGODB_PASSWORD, authSource=bot_config.MONGODB_DATABASE, authMechanism='SCRAM-SHA-1')
-db = mongo[bot_config.MONGODB_DATABASE]
-
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 def to_lower(word: str):
     return word.lower()
 
@@ -71,7 +60,7 @@ class Notes(commands.Cog):
             embed = discord.Embed(title="❌ That doesn't look like a valid note hash", colour=ctx.guild.me.colour)
             await ctx.send(embed=embed)
             return
-        data = await db.notes.find_one({'hash': note_hash})
+        data = await database.notes.find_one({'hash': note_hash})
         if data is None:
             await ctx.send(embed=discord.Embed(title='No note found with this hash', colour=ctx.guild.me.colour))
             return
@@ -86,7 +75,7 @@ class Notes(commands.Cog):
             embed = discord.Embed(description="❌ That doesn't look like a valid note hash", colour=ctx.guild.me.colour)
             await ctx.send(embed=embed)
             return
-        note = await db.notes.find_one({"hash": note_hash})
+        note = await database.notes.find_one({"hash": note_hash})
         if not note:
             embed = discord.Embed(description="❌ No note found with this hash", colour=ctx.guild.me.colour)
             await ctx.send(embed=embed)
@@ -117,7 +106,7 @@ class Notes(commands.Cog):
             if reaction.emoji == '✅':  # Execute order 66
                 try:
                     await messageObject.clear_reactions()
-                    await db.notes.delete_one({"hash": note_hash})
+                    await database.notes.delete_one({"hash": note_hash})
                     logging.info(f"Removed user note {note_hash} from the database")
                     embed = discord.Embed(description=f"User note with hash `{note_hash}` removed from the database successfully 🤠", colour=ctx.guild.me.colour)
                     await ctx.send(embed=embed)
@@ -143,7 +132,7 @@ class Notes(commands.Cog):
         'hash': await self.gen_hash(),
         'date_added': int(time.time())}
         try:
-            await db.notes.insert_one(note)
+            await database.notes.insert_one(note)
             logging.info(f"Added user note {note['hash']} to the database")
             embed = self.make_note_embed(note=note, colour=ctx.guild.me.colour)
             await ctx.send(content="Saved note successfully 🤠", embed=embed)
@@ -167,10 +156,10 @@ class Notes(commands.Cog):
 
     async def get_notes(self, user_id: str) -> Tuple[dict]:
         """Retrieve notes from DB by user ID"""
-        n = await db.notes.count_documents({"user": user_id})
+        n = await database.notes.count_documents({"user": user_id})
         if n == 0:
             return ()
-        data = db.notes.find({"user": user_id})
+        data = database.notes.find({"user": user_id})
         notes = []
         data.limit(n)
         async for note in data:
@@ -183,7 +172,7 @@ class Notes(commands.Cog):
         unique = False
         while not unique:
             note_hash = ''.join(random.choice(string.ascii_lowercase+string.digits) for i in range(7))
-            data = await db.notes.find_one({'hash': note_hash})
+            data = await database.notes.find_one({'hash': note_hash})
             if not data:
                 return note_hash
 
@@ -1,24 +1,14 @@
-import sys
-import motor
 import logging
 import discord
 import datetime
 
 from discord.ext import commands
 from unity_util import bot_config
+from unity_util import database
 
 
 REPORT_EMOJI = "⚠️"
 
-mongo = motor.motor_asyncio.AsyncIOMotorClient(host=bot_config.MONGODB_HOST, port=int(
-    bot_config.MONGODB_PORT), replicaSet="rs01", username=bot_config.MONGODB_USERNAME, password=bot_config.MONGODB_PASSWORD, authSource=bot_config.MONGODB_DATABASE, authMechanism='SCRAM-SHA-1')
-db = mongo[bot_config.MONGODB_DATABASE]
-
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 
 class ReactReport(commands.Cog):
     def __init__(self, client):
@@ -103,19 +93,19 @@ class ReactReport(commands.Cog):
     async def save_report_data(self, data: dict):
         # Check if this message has been reported already.
         # If so, then do nothing.
-        count = await db.reports.count_documents({"message_id": data["message_id"]})
+        count = await database.reports.count_documents({"message_id": data["message_id"]})
         if count > 0:
             return False
 
-        await db.reports.insert_one(data)
+        await database.reports.insert_one(data)
         return True
 
     async def remove_report_data(self, message_id: int):
-        count = await db.reports.count_documents({"message_id": message_id})
+        count = await database.reports.count_documents({"message_id": message_id})
         if count == 0:
             return False
 
-        await db.reports.delete_one({"message_id": message_id})
+        await database.reports.delete_one({"message_id": message_id})
         return True
 
     async def fetch_objects_from_payload(self, payload: discord.RawReactionActionEvent):
@@ -1,18 +1,11 @@
 import re
-import sys
 import logging
 import discord
 
 from discord.ext import commands
-from unity_util import bot_config
 from unity_services import universal_scammer_list as usl
 
 
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
-
 EMBED_BANNED_COLOUR = 0xb00e0e
 EMBED_NOT_BANNED_COLOUR = 0x3cb00e
 
@@ -1,76 +1,134 @@
-import json
 import discord
 from discord.ext import commands, tasks
+from discord.http import Route
 import asyncio
-import motor.motor_asyncio
 from datetime import datetime as dt
 import logging
 import re
+import sys
+import time
 import praw
+from pymongo import UpdateMany, UpdateOne
+from pymongo.collation import Collation, CollationStrength
+from pymongo.errors import OperationFailure, PyMongoError
 from unity_util import bot_config
+from unity_util import database
+from unity_util.user_cache import UserDirectoryCache
+from unity_util.micro_batcher import MicroBatcher
+from unity_util.name_index import NAME_FIELDS, TrigramIndex
+from unity_util import trade_roles
 from unity_services import universal_scammer_list as usl
-import sys
-
-with open('config.json', 'r') as f:
-    conf = json.load(f)
+from unity_services.reddit_flair import FlairWorker
 
 reddit = praw.Reddit(client_id=bot_config.PRAW_CLIENT_ID, client_secret=bot_config.PRAW_CLIENT_SECRET,
                      username=bot_config.PRAW_USERNAME, password=bot_config.PRAW_PASSWORD, user_agent=bot_config.PRAW_USER_AGENT)
 
-mongo = motor.motor_asyncio.AsyncIOMotorClient(host=bot_config.MONGODB_HOST, port=int(
-    bot_config.MONGODB_PORT), replicaSet="rs01", username=bot_config.MONGODB_USERNAME, password=bot_config.MONGODB_PASSWORD, authSource=bot_config.MONGODB_DATABASE, authMechanism='SCRAM-SHA-1')
-db = mongo[bot_config.MONGODB_DATABASE]
-
-logging.basicConfig(level=logging.INFO, format="[%(levelname)s]\t %(name)s: %(message)s", handlers=[
-    logging.StreamHandler(sys.stdout),
-    logging.FileHandler(f'./logs/{bot_config.LOGGING_FILENAME}')
-])
+# How often to poll the queue while the change stream is unavailable
+QUEUE_POLL_SECONDS = 20
+# Change stream errors after which the stored resume token can't be used again
+INVALID_RESUME_TOKEN_CODES = (280, 286)
+# Queue entries loaded per batch, verifications run at once, and attempts per user before leaving them queued
+QUEUE_BATCH_SIZE = 500
+VERIFY_CONCURRENCY = 10
+VERIFY_ATTEMPTS = 3
+# How often to sweep the queue for users left there after running out of attempts
+QUEUE_RETRY_MINUTES = 5
+# Names are matched case-insensitively through indexes built with this collation
+CASE_INSENSITIVE = Collation(locale='en', strength=CollationStrength.SECONDARY)
+USER_NAME_INDEXES = [("reddit.name", "reddit_name_ci"), ("discord.username", "discord_username_ci"), ("discord.name", "discord_name_ci")]
+USER_CACHE_SIZE = 2048
+USER_CACHE_SECONDS = 300
+# Users streamed per batch and role edits in flight when syncing the verified role
+VERIFIED_SYNC_BATCH_SIZE = 1000
+VERIFIED_SYNC_CONCURRENCY = 5
+# Refuse to take the verified role from more than this share of its holders in one pass
+VERIFIED_SYNC_MAX_REMOVE_RATIO = 0.1
+# How long whois waits on each of its data sources before showing it as unavailable
+WHOIS_SOURCE_TIMEOUT_SECONDS = 3
+UNAVAILABLE = object()
+# Joins are looked up together, one query per this many members or this many seconds, whichever comes first
+JOIN_BATCH_SIZE = 100
+JOIN_BATCH_SECONDS = 0.25
+# Ban and unban events are written to the database together, in batches of up to this many or after this many seconds
+BAN_BATCH_SIZE = 500
+BAN_BATCH_SECONDS = 1
+# Discord's largest page of bans
+BAN_PAGE_SIZE = 1000
+# Refuse to clear the banned flag from more than this share of flagged users in one pass
+BAN_SYNC_MAX_UNBAN_RATIO = 0.1
+# How often to check the subreddit's ban list, and Reddit names looked up per database query
+REDDIT_BAN_SYNC_MINUTES = 30
+REDDIT_BAN_BATCH_SIZE = 100
+# Users loaded per batch when building the name index, and suggestions shown when whois finds nobody
+NAME_INDEX_BATCH_SIZE = 1000
+WHOIS_SUGGESTIONS = 5
 
 class Verify(commands.Cog):
 
     def __init__(self, client):
         self.client = client
-        self.monitor_db.start()
+        self.user_cache = UserDirectoryCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_SECONDS)
+        self.name_index = TrigramIndex()
+        self.flair_worker = FlairWorker(reddit.subreddit("hardwareswapuk"), self.client.loop)
+        self.join_batcher = MicroBatcher(self.verify_joined_members, max_size=JOIN_BATCH_SIZE,
+                                         max_delay=JOIN_BATCH_SECONDS, loop=self.client.loop)
+        self.ban_batcher = MicroBatcher(self.write_bans, max_size=BAN_BATCH_SIZE,
+                                        max_delay=BAN_BATCH_SECONDS, loop=self.client.loop)
+        self.ensure_indexes_task = self.client.loop.create_task(self.ensure_indexes())
+        self.build_name_index_task = self.client.loop.create_task(self.build_name_index())
+        self.queue_lock = asyncio.Lock()
+        self.watch_queue_task = self.client.loop.create_task(self.watch_queue())
+        self.startup_sync_task = None
+        if bot_config.VERIFIED_SYNC_ON_STARTUP:
+            self.startup_sync_task = self.client.loop.create_task(self.startup_sync_verified_role())
+        self.startup_ban_sync_task = None
+        if bot_config.BAN_SYNC_ON_STARTUP:
+            self.startup_ban_sync_task = self.client.loop.create_task(self.startup_sync_bans())
+        self.reddit_ban_sync.start()
+        self.queue_retry_sweep.start()
 
     def cog_unload(self):
-        self.monitor_db.cancel()
+        self.ensure_indexes_task.cancel()
+        self.build_name_index_task.cancel()
+        self.watch_queue_task.cancel()
+        if self.startup_sync_task is not None:
+            self.startup_sync_task.cancel()
+        if self.startup_ban_sync_task is not None:
+            self.startup_ban_sync_task.cancel()
+        self.reddit_ban_sync.cancel()
+        self.queue_retry_sweep.cancel()
+        self.flair_worker.close()
+        self.join_batcher.close()
+        self.ban_batcher.close()
 
     # Events
     @commands.Cog.listener()
     async def on_ready(self):
         print('Verify cog online')
-        try:
-            n = await db.queue.count_documents({})
-            if n == 0:
-                return
-            data = db.queue.find()
-            data.limit(n)
-            async for document in data:
-                user = await db.users.find_one({"_id": document['ref']})
-                await self.set_verified(user['discord']['id'])
-                await db.queue.find_one_and_delete({'_id': document['_id']})
-                logging.info(f'Verified user: {user}')
-        except Exception as err:
-            logging.error(f'ERROR MONITORING DB: {err}')
 
 
     @commands.Cog.listener()
     async def on_member_join(self, member: discord.Member):
-        data = await db.users.find_one({"discord.id": str(member.id)})
-
-        if(data and data.get("verified")):  # Check if user has verified online first
-            await self.set_verified(member.id)
+        try:
+            await self.join_batcher.submit(member)
+        except Exception as err:
+            logging.error(f'ERROR CHECKING {member.name}#{member.discriminator} ON JOIN: {err}')
 
     @commands.Cog.listener()
-    async def on_member_ban(self, member: discord.Member):
-        await db.users.find_one_and_update({"discord.id": member.id}, {"verified": False, "banned": True})
-        logging.info(
-            f'BANNED {member.name + "#" + member.discriminator} ON {member.server.name}')
+    async def on_member_ban(self, guild, user):
+        logging.info(f'BANNED {user.name}#{user.discriminator} ON {guild.name}')
+        try:
+            await self.ban_batcher.submit((str(user.id), True))
+        except Exception as err:
+            logging.error(f'ERROR RECORDING BAN FOR {user.name}#{user.discriminator}: {err}')
 
     @commands.Cog.listener()
     async def on_member_unban(self, guild, user):
-        await db.users.find_one_and_update({"discord.id": user.id}, {"banned": False})
         logging.info(f'UNBANNED {user.name}#{user.discriminator} ON {guild.name}')
+        try:
+            await self.ban_batcher.submit((str(user.id), False))
+        except Exception as err:
+            logging.error(f'ERROR RECORDING UNBAN FOR {user.name}#{user.discriminator}: {err}')
 
     # Commands
 
@@ -96,8 +154,11 @@ class Verify(commands.Cog):
         else:
             user_data = await self.get_user(user)
         if not user_data:
+            suggestions = self.suggest_users(user) if not ctx.message.mentions else []
             user = user.replace('`', '``')
             embed = discord.Embed(title = "Whois results:", description=f"No results found for {user}")
+            if suggestions:
+                embed.add_field(name="Did you mean", value="\n".join(suggestions).replace('_', '\\_'))
             await ctx.send(embed=embed)
             return
         else:
@@ -124,7 +185,7 @@ class Verify(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        if flair not in conf['flairs']:
+        if flair not in trade_roles.ROLE_IDS:
             embed = discord.Embed(
                 description=f"Flair {flair} not found 🙁".replace('`', '``'),
                 color=ctx.guild.me.colour
@@ -132,9 +193,7 @@ class Verify(commands.Cog):
             await ctx.send(embed=embed)
             return
 
-        # remove old role
-        await self.remove_trades(user_data['discord']['id'])
-        # set flair and new role
+        # set flair and swap the trade role
         if await self.set_trade_flair(user_data, flair) == True:
             desc = [f"✅ Flair set successfully for {user_data['reddit']['name']}"]
         else:
@@ -223,7 +282,9 @@ class Verify(commands.Cog):
                 return
             if reaction.emoji == '✅':  # Execute order 66
                 try:
-                    await db.users.delete_one({"discord.id": f"{user_data['discord']['id']}"})
+                    await database.users.delete_one({"discord.id": f"{user_data['discord']['id']}"})
+                    self.user_cache.invalidate(user_data['discord']['id'])
+                    self.name_index.remove(user_data['discord']['id'])
                     logging.info(f"Removed user {user_data['discord']['username']} from the database")
                     server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
                     member = server.get_member(int(user_data['discord']['id']))
@@ -235,10 +296,51 @@ class Verify(commands.Cog):
                     logging.error(f"ERROR REMOVING USER: {err}")
                     await ctx.send("Couldn't remove the user from the database for some reason. Please consult the logs for more details")
 
+    @commands.command(name='usercache')
+    @commands.is_owner()
+    async def user_cache_stats(self, ctx):
+        """Show verified user cache statistics"""
+        stats = self.user_cache.stats()
+        embed = discord.Embed(title="User cache")
+        embed.add_field(name="Cached users", value=stats['size'], inline=True)
+        embed.add_field(name="Hits", value=stats['hits'], inline=True)
+        embed.add_field(name="Misses", value=stats['misses'], inline=True)
+        embed.add_field(name="Hit rate", value=f"{stats['hit_rate']:.1%}", inline=True)
+        await ctx.send(embed=embed)
+
+    @commands.command(name='syncverified')
+    @commands.is_owner()
+    async def sync_verified(self, ctx):
+        """Give or take the verified role to match the verification database"""
+        async with ctx.channel.typing():
+            results = await self.sync_verified_role()
+        embed = discord.Embed(title="Verified role sync")
+        embed.add_field(name="Roles added", value=f"{results['added']} ({results['add_failed']} failed)", inline=True)
+        embed.add_field(name="Roles removed", value=f"{results['removed']} ({results['remove_failed']} failed)", inline=True)
+        if results['removal_skipped']:
+            embed.set_footer(text=f"Skipped removing the role from {results['removal_skipped']} members - too many to be safe, check the database")
+        await ctx.send(embed=embed)
+
+    @commands.command(name='syncbans')
+    @commands.is_owner()
+    async def sync_bans_command(self, ctx):
+        """Mark users banned or unbanned in the database to match the server's ban list"""
+        async with ctx.channel.typing():
+            results = await self.sync_bans()
+        embed = discord.Embed(title="Ban sync")
+        embed.add_field(name="Server bans", value=results['bans'], inline=True)
+        embed.add_field(name="Marked banned", value=results['banned'], inline=True)
+        embed.add_field(name="Marked unbanned", value=results['unbanned'], inline=True)
+        if results['unban_skipped']:
+            embed.set_footer(text=f"Skipped marking {results['unban_skipped']} users unbanned - too many to be safe, check the database")
+        await ctx.send(embed=embed)
+
     # Helper functions
 
     # Useful for verification event
-    async def set_verified(self, member_id):
+    async def set_verified(self, member_id) -> bool:
+        """Give a member the verified role and congratulate them.
+        Returns False if the role couldn't be added."""
         # Get guild object from ID
         server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
         # Get role object of verified role by ID
@@ -246,44 +348,116 @@ class Verify(commands.Cog):
         # Get member object by discord user ID
         member = server.get_member(int(member_id))
 
-        if member:  # Someone might verify before they join the server
-            try:
-                await member.add_roles(role)  # Add user as verified
-                # Send the verified message
-                await member.send("Congratulations! You are now verified!")
-                logging.info(
-                    f'VERIFIED {member.name}#{member.discriminator} ON {server.name}')
+        if not member:  # Someone might verify before they join the server
+            return True
 
-            except Exception as e:
-                # Log an error if there was a problem
-                logging.error(
-                    f'ERROR ADDING ROLE FOR {member.name}#{member.discriminator} IN {server.name}: {e}')
+        try:
+            await member.add_roles(role)  # Add user as verified
+        except Exception as e:
+            # Log an error if there was a problem
+            logging.error(
+                f'ERROR ADDING ROLE FOR {member.name}#{member.discriminator} IN {server.name}: {e}')
+            return False
+
+        try:
+            # Send the verified message
+            await member.send("Congratulations! You are now verified!")
+        except discord.HTTPException as e:
+            logging.warning(f'Could not send verified message to {member.name}#{member.discriminator}: {e}')
+        logging.info(
+            f'VERIFIED {member.name}#{member.discriminator} ON {server.name}')
+        return True
 
     # Useful for whois and editflair
     async def get_user(self, user: str) -> dict:
         discord_discrim_regex = re.compile("[\w]*#[0-9]{4}")  # eg. issy#4200
         if user.isdigit() and len(user) > 15:  # eg. 377212919068229633
-            user_type = 'discord.id'
+            lookups = [("discord.id", user)]
         # eg. /u/issythegurl or u/issythegurl
         elif user.startswith('u/') or user.startswith('/u/'):
             user = user.split('u/')[1]
-            user_type = 'reddit.name'
+            lookups = [("reddit.name", user)]
         elif discord_discrim_regex.match(user) != None:
-            user_type = 'discord.name'
+            lookups = [("discord.name", user)]
         else:
-            # Guess if it's a Reddit or Discord user
-            for i in ['reddit.name','discord.username']:
-                data = await db.users.find_one({f"{i}": {"$regex": f"^{user}$", "$options": "i"}})
-                if data:
-                    return data
-                else:
-                    continue
-            if not data:
-                return {}
-        data = await db.users.find_one({f"{user_type}": {"$regex": f"^{user}$", "$options": "i"}})
-        if data:
-            return data
-        return {}
+            # Guess if it's a Reddit or Discord user, preferring a Reddit match
+            lookups = [("reddit.name", user), ("discord.username", user)]
+
+        data = self.user_cache.find(lookups)
+        if data is None:
+            data = await self.find_user(lookups)
+            if data:
+                self.user_cache.put(data, lookups)
+                self.name_index.add(data)
+        return data or {}
+
+    async def find_user(self, lookups: list) -> dict:
+        """Look a user up in the database by the first of the (field, value) lookups that matches"""
+        field, value = lookups[0]
+        if field == "discord.id":
+            return await database.users.find_one({"discord.id": value})
+        # One indexed query per lookup, in order, so an earlier field always wins over a later one
+        for field, value in lookups:
+            data = await database.users.find_one({field: value}, collation=CASE_INSENSITIVE)
+            if data:
+                return data
+        return None
+
+    async def verify_joined_members(self, members: list):
+        """Give the verified role to any of a batch of new members who have verified online first.
+        Members not in the user cache are looked up with a single query."""
+        verified = set()
+        uncached = []
+        for member in members:
+            data = self.user_cache.find([("discord.id", str(member.id))])
+            if data is None:
+                uncached.append(str(member.id))
+            elif data.get("verified"):
+                verified.add(str(member.id))
+        if uncached:
+            async for data in database.users.find({"discord.id": {"$in": uncached}}):
+                self.user_cache.put(data)
+                if data.get("verified"):
+                    verified.add(data['discord']['id'])
+
+        semaphore = asyncio.Semaphore(VERIFY_CONCURRENCY)
+
+        async def grant(member):
+            async with semaphore:
+                await self.set_verified(member.id)
+
+        await asyncio.gather(*[grant(i) for i in members if str(i.id) in verified])
+
+    def suggest_users(self, user: str) -> list:
+        """Describe the closest indexed names to a whois search that found nobody"""
+        if user.isdigit():
+            return []
+        query = user.split('u/')[1] if user.startswith(('u/', '/u/')) else user.split('#')[0]
+        return [
+            f"{'u/' if field == 'reddit.name' else ''}{name} ({NAME_FIELDS[field]})"
+            for _, field, name, _ in self.name_index.search(query, limit=WHOIS_SUGGESTIONS)
+        ]
+
+    async def build_name_index(self):
+        """Index every user's names from a projected scan, a batch at a time so the event loop isn't held up"""
+        try:
+            projection = {"discord.id": 1, "discord.username": 1, "reddit.name": 1}
+            async for user in database.users.find({}, projection).batch_size(NAME_INDEX_BATCH_SIZE):
+                self.name_index.add(user)
+            logging.info(f"Indexed names of {len(self.name_index)} users")
+        except Exception as err:
+            logging.error(f"ERROR BUILDING NAME INDEX: {err}")
+
+    async def ensure_indexes(self):
+        """Make sure every get_user lookup can be served by an index.
+        The collated indexes have names of their own, so they can sit alongside any plain index the verify site
+        has made on the same field, and each is created separately so one conflict doesn't stop the rest."""
+        indexes = [("discord.id", {})] + [(key, {'name': name, 'collation': CASE_INSENSITIVE}) for key, name in USER_NAME_INDEXES]
+        for key, options in indexes:
+            try:
+                await database.users.create_index(key, **options)
+            except Exception as err:
+                logging.error(f"ERROR CREATING USER INDEX ON {key}: {err}")
 
     # Used for the whois commmand
     async def make_whois_embed(self, user_data: dict) -> discord.Embed:
@@ -293,68 +467,79 @@ class Verify(commands.Cog):
             name='Discord', value=f"<@{user_data['discord']['id']}>", inline=True)
         embed.add_field(
             name='Reddit', value=f"[u/{user_data['reddit']['name']}](https://www.reddit.com/user/{user_data['reddit']['name']})", inline=True)
-        trades = await self.get_trades(user_data['discord']['id'])
-        if trades:
+        trades, usl_status = await asyncio.gather(
+            self.fetch_whois_source('trades', self.get_trades(user_data['discord']['id'])),
+            self.fetch_whois_source('USL', usl.fetch_usl_user_data(user_data['reddit']['name']))
+        )
+        if trades is UNAVAILABLE:
+            embed.add_field(name='Trades', value="Unavailable", inline=False)
+        elif trades:
             embed.add_field(name='Trades', value=trades, inline=False)
-        usl_status = await usl.fetch_usl_user_data(user_data['reddit']['name'])
-        embed.add_field(name="On USL", value="Unknown - USL API unavailable", inline=True)
+        if usl_status is UNAVAILABLE:
+            embed.add_field(name="On USL", value="Unknown - USL API unavailable", inline=True)
+        elif isinstance(usl_status, dict):
+            embed.add_field(name="On USL", value="Yes ⚠️" if usl_status.get('banned') else "No", inline=True)
+        else:
+            embed.add_field(name="On USL", value=str(usl_status), inline=True)
         days_ago = dt.now() - dt.fromtimestamp(user_data['verified_at'])
         embed.set_footer(text=f"Verified {days_ago.days} days ago")
         return embed
 
+    async def fetch_whois_source(self, name: str, source):
+        """Await one of whois's data sources, giving UNAVAILABLE if it fails or is too slow"""
+        try:
+            return await asyncio.wait_for(source, WHOIS_SOURCE_TIMEOUT_SECONDS)
+        except Exception as err:
+            logging.warning(f"Whois source {name} unavailable: {err!r}")
+            return UNAVAILABLE
+
     # Used in for whois and editflair
     async def get_trades(self, discord_id: str) -> str:
         """Get the trade role of a member"""
-        trade_roles = [conf['flairs'][i]['rid'] for i in conf['flairs']]
         guild = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
         member = guild.get_member(int(discord_id))
-        # returns all roles in member, lowest in hierarchy first
-        member_roles = member.roles
-        member_roles.reverse()  # get highest trade roles first
-        member_trade_roles = [i for i in member_roles if i.id in trade_roles]
+        if member is None:
+            return
+        member_trade_roles = trade_roles.trade_roles_of(member.roles)
         if not member_trade_roles:
             return
         elif len(member_trade_roles) == 1:
             return member_trade_roles[0].name
         else: # If member_trade_roles > 1
-            await member.remove_roles(member_trade_roles[1:])
+            # Tidy up the extra roles in the background rather than holding up the caller
+            self.client.loop.create_task(self.remove_duplicate_trades(member, member_trade_roles[1:]))
             return member_trade_roles[0].name
 
-    # Used in editflair
-    async def remove_trades(self, discord_id: int):
-        """Remove all trade roles from a member"""
-        # Get guild object from ID
-        server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
-        # Get member object by discord user ID
-        member = server.get_member(int(discord_id))
-        trade_roles = [conf['flairs'][i]['rid'] for i in conf['flairs']]
-        member_trade_roles = [i for i in member.roles if i.id in trade_roles]
-        if member_trade_roles:
-            for role in member_trade_roles:
-                await member.remove_roles(role)
+    async def remove_duplicate_trades(self, member: discord.Member, roles: list):
+        try:
+            await member.remove_roles(*roles)
+        except discord.HTTPException as err:
+            logging.error(f"ERROR REMOVING DUPLICATE TRADE ROLES FOR {member.name}#{member.discriminator}: {err}")
 
     # Useful for editflair
     async def set_trade_flair(self, user_data, flair):
         try:
             flair_text = f"{flair} Trades"
-            reddit.subreddit("hardwareswapuk").flair.set(user_data["reddit"]["name"], flair_text, css_class=flair_text.replace("+", ""))
+            return await self.flair_worker.set_flair(user_data["reddit"]["name"], flair_text, css_class=flair_text.replace("+", ""))
         except Exception as err:
             logging.error(
                 f"ERROR SETTING FLAIR FOR {user_data['reddit']['name']}: {err}"
             )
             return False
-        return True
 
     # Useful for editflair
     async def set_trade_role(self, user_data, flair):
+        """Swap a member's trade roles for the given flair's role in a single edit"""
         # Get guild object from ID
         server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
-        # Get role object of verified role by ID
-        role = server.get_role(conf['flairs'][flair]['rid'])
+        # Get role object of the trade role by ID
+        role = server.get_role(trade_roles.ROLE_IDS[flair])
         # Get member object by discord user ID
         member = server.get_member(int(user_data['discord']['id']))
+        if member is None:
+            return False
         try:
-            await member.add_roles(role)
+            await member.edit(roles=trade_roles.with_trade_role(member.roles, role))
             return True
         except Exception as err:
             logging.error(
@@ -362,24 +547,379 @@ class Verify(commands.Cog):
             )
             return False
 
-    # Tasks
+    # Verified role sync
 
-    @tasks.loop(seconds=20)
-    async def monitor_db(self):
-        """Monitor DB for changes"""
+    async def startup_sync_verified_role(self):
+        await self.client.wait_until_ready()
         try:
-            n = await db.queue.count_documents({})
-            if n == 0:
-                return
-            data = db.queue.find()
-            data.limit(n)
-            async for document in data:
-                user = await db.users.find_one({"_id": document['ref']})
-                await self.set_verified(user['discord']['id'])
-                await db.queue.find_one_and_delete({'_id': document['_id']})
-                logging.info(f'Verified user: {user}')
+            results = await self.sync_verified_role()
+            logging.info(f"Startup verified role sync: {results}")
+        except Exception as err:
+            logging.error(f"ERROR SYNCING VERIFIED ROLE: {err}")
+
+    async def sync_verified_role(self) -> dict:
+        """Stream verified users from the database and compare them against the cached member list.
+        Memory use is bounded by the guild's size rather than the database's."""
+        server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
+        role = server.get_role(int(bot_config.DISCORD_VERIFIED_ROLE))
+        member_ids = {i.id for i in server.members}
+        role_holder_ids = {i.id for i in role.members}
+
+        to_add = []
+        # Role holders not yet seen as verified in the database; whoever is left at the end loses the role
+        unconfirmed = set(role_holder_ids)
+        cursor = database.users.find({"verified": True}, {"discord.id": 1, "verified": 1}).batch_size(VERIFIED_SYNC_BATCH_SIZE)
+        async for user in cursor:
+            discord_id = int(user['discord']['id'])
+            unconfirmed.discard(discord_id)
+            if discord_id in member_ids and discord_id not in role_holder_ids:
+                to_add.append(discord_id)
+
+        removal_skipped = 0
+        to_remove = list(unconfirmed)
+        if len(to_remove) > VERIFIED_SYNC_MAX_REMOVE_RATIO * len(role_holder_ids):
+            logging.warning(f"Verified role sync would remove the role from {len(to_remove)} of {len(role_holder_ids)} members, skipping removals")
+            removal_skipped = len(to_remove)
+            to_remove = []
+
+        semaphore = asyncio.Semaphore(VERIFIED_SYNC_CONCURRENCY)
+
+        async def edit(member_id, add):
+            member = server.get_member(member_id)
+            if member is None:
+                return False
+            async with semaphore:
+                try:
+                    if add:
+                        await member.add_roles(role)
+                    else:
+                        await member.remove_roles(role)
+                    return True
+                except discord.HTTPException as err:
+                    logging.error(f"ERROR SYNCING VERIFIED ROLE FOR {member.name}#{member.discriminator}: {err}")
+                    return False
+
+        added = await asyncio.gather(*[edit(i, True) for i in to_add])
+        removed = await asyncio.gather(*[edit(i, False) for i in to_remove])
+        return {
+            'added': sum(added),
+            'add_failed': len(added) - sum(added),
+            'removed': sum(removed),
+            'remove_failed': len(removed) - sum(removed),
+            'removal_skipped': removal_skipped
+        }
+
+    # Ban sync
+
+    async def startup_sync_bans(self):
+        """Catch up on bans and unbans made while the bot was offline"""
+        await self.client.wait_until_ready()
+        try:
+            results = await self.sync_bans()
+            logging.info(f"Startup ban sync: {results}")
+        except Exception as err:
+            logging.error(f"ERROR SYNCING BANS: {err}")
+
+    async def sync_bans(self) -> dict:
+        """Diff the server's ban list against the database's banned flags and write the corrections in one go"""
+        banned_ids = await self.fetch_ban_ids(int(bot_config.DISCORD_SERVER_ID))
+
+        to_ban = []
+        to_unban = []
+        flagged = 0
+        query = {"$or": [{"banned": True}, {"discord.id": {"$in": list(banned_ids)}}]}
+        async for user in database.users.find(query, {"discord.id": 1, "banned": 1}):
+            discord_id = str(user['discord']['id'])
+            if user.get("banned"):
+                flagged += 1
+            should_be_banned = discord_id in banned_ids
+            if bool(user.get("banned")) != should_be_banned:
+                (to_ban if should_be_banned else to_unban).append((discord_id, should_be_banned))
+
+        unban_skipped = 0
+        if len(to_unban) > BAN_SYNC_MAX_UNBAN_RATIO * flagged:
+            logging.warning(f"Ban sync would mark {len(to_unban)} of {flagged} banned users unbanned, skipping unbans")
+            unban_skipped = len(to_unban)
+            to_unban = []
+
+        await self.write_bans(to_ban + to_unban)
+        return {
+            'bans': len(banned_ids),
+            'banned': len(to_ban),
+            'unbanned': len(to_unban),
+            'unban_skipped': unban_skipped
+        }
+
+    async def fetch_ban_ids(self, guild_id: int) -> set:
+        """Page through the whole ban list. Guild.bans() only gets the first page of up to 1000 bans,
+        which would make sync_bans unban everyone past it."""
+        banned_ids = set()
+        after = None
+        while True:
+            params = {'limit': BAN_PAGE_SIZE}
+            if after is not None:
+                params['after'] = after
+            page = await self.client.http.request(Route('GET', '/guilds/{guild_id}/bans', guild_id=guild_id), params=params)
+            banned_ids.update(str(i['user']['id']) for i in page)
+            if len(page) < BAN_PAGE_SIZE:
+                return banned_ids
+            after = max(int(i['user']['id']) for i in page)
+
+    async def write_bans(self, changes: list):
+        """Write (discord ID, banned) changes with a single bulk write. Only the latest change for each user is kept."""
+        latest = dict(changes)
+        if not latest:
+            return
+        requests = []
+        for discord_id, banned in latest.items():
+            update = {"banned": True, "verified": False} if banned else {"banned": False}
+            requests.append(UpdateMany({"discord.id": discord_id}, {"$set": update}))
+        await database.users.bulk_write(requests, ordered=False)
+        for discord_id in latest:
+            self.user_cache.invalidate(discord_id)
+
+    @tasks.loop(minutes=REDDIT_BAN_SYNC_MINUTES)
+    async def reddit_ban_sync(self):
+        try:
+            results = await self.sync_reddit_bans()
+            if results['bans']:
+                logging.info(f"Reddit ban sync: {results}")
+        except Exception as err:
+            logging.error(f"ERROR SYNCING REDDIT BANS: {err}")
+
+    @reddit_ban_sync.before_loop
+    async def before_reddit_ban_sync(self):
+        await self.client.wait_until_ready()
+
+    async def fetch_new_reddit_bans(self, newest: float, seen: set) -> list:
+        """Page through the subreddit's ban list, newest first, until reaching bans seen by the last pass.
+        Runs in the flair worker's thread so PRAW never blocks the event loop."""
+        def fetch():
+            bans = []
+            for ban in self.flair_worker.subreddit.banned(limit=None):
+                if ban.date < newest:
+                    break
+                if ban.date == newest and ban.name.lower() in seen:
+                    continue
+                bans.append((ban.name, ban.date))
+            return bans
+
+        return await self.client.loop.run_in_executor(self.flair_worker.executor, fetch)
+
+    async def sync_reddit_bans(self) -> dict:
+        """Flag users banned from the subreddit since the last pass and take their verified role.
+        The cursor is the newest ban date seen, along with the names banned at that second."""
+        state = await database.state.find_one({'_id': 'reddit_ban_sync'}) or {}
+        newest = state.get('newest', 0)
+        seen = set(state.get('seen', []))
+        bans = await self.fetch_new_reddit_bans(newest, seen)
+
+        server = self.client.get_guild(int(bot_config.DISCORD_SERVER_ID))
+        role = server.get_role(int(bot_config.DISCORD_VERIFIED_ROLE))
+        semaphore = asyncio.Semaphore(VERIFIED_SYNC_CONCURRENCY)
+
+        async def remove_role(discord_id):
+            member = server.get_member(int(discord_id))
+            if member is None or role not in member.roles:
+                return False
+            async with semaphore:
+                try:
+                    await member.remove_roles(role)
+                    logging.info(f"Removed verified role from {member.name}#{member.discriminator}, banned on Reddit")
+                    return True
+                except discord.HTTPException as err:
+                    logging.error(f"ERROR REMOVING VERIFIED ROLE FROM {member.name}#{member.discriminator}: {err}")
+                    return False
+
+        flagged = roles_removed = 0
+        for i in range(0, len(bans), REDDIT_BAN_BATCH_SIZE):
+            names = [name for name, _ in bans[i:i + REDDIT_BAN_BATCH_SIZE]]
+            users = await database.users.find({"reddit.name": {"$in": names}}, {"discord.id": 1},
+                                              collation=CASE_INSENSITIVE).to_list(length=None)
+            if not users:
+                continue
+            await database.users.bulk_write([
+                UpdateOne({"_id": user['_id']}, {"$set": {"reddit_banned": True, "verified": False}}) for user in users
+            ], ordered=False)
+            for user in users:
+                self.user_cache.invalidate(user['discord']['id'])
+            flagged += len(users)
+            roles_removed += sum(await asyncio.gather(*[remove_role(user['discord']['id']) for user in users]))
+
+        if bans:
+            latest = max(date for _, date in bans)
+            names = {name.lower() for name, date in bans if date == latest}
+            if latest == newest:
+                names |= seen
+            await database.state.update_one({'_id': 'reddit_ban_sync'}, {'$set': {'newest': latest, 'seen': list(names)}}, upsert=True)
+        return {'bans': len(bans), 'flagged': flagged, 'roles_removed': roles_removed}
+
+    # Verification queue
+
+    async def watch_queue(self):
+        """Verify users as soon as the verify site queues them, using a change stream on the queue.
+        Anything queued while the bot was down is caught up when the stream opens,
+        and the queue is polled instead whenever the stream is unavailable."""
+        await self.client.wait_until_ready()
+        while True:
+            try:
+                resume_token = await self.load_resume_token()
+                pipeline = [{'$match': {'operationType': 'insert'}}]
+                async with database.queue.watch(pipeline, resume_after=resume_token) as stream:
+                    # The stream is open, so nothing inserted from here on can be missed
+                    await self.process_queue()
+                    async for change in stream:
+                        # The catch-up pass or a sweep may already have handled it, which process_queue_batch checks
+                        await self.process_queue_batch([change['fullDocument']])
+                        await self.save_resume_token(stream.resume_token)
+            except asyncio.CancelledError:
+                raise
+            except Exception as err:
+                logging.error(f'ERROR WATCHING QUEUE, POLLING INSTEAD: {err}')
+                if isinstance(err, OperationFailure) and err.code in INVALID_RESUME_TOKEN_CODES:
+                    await self.save_resume_token(None)
+                await self.process_queue()
+                await asyncio.sleep(QUEUE_POLL_SECONDS)
+
+    async def process_queue(self):
+        """Verify everyone currently in the queue"""
+        try:
+            batch = []
+            async for document in database.queue.find():
+                batch.append(document)
+                if len(batch) >= QUEUE_BATCH_SIZE:
+                    await self.process_queue_batch(batch)
+                    batch = []
+            if batch:
+                await self.process_queue_batch(batch)
         except Exception as err:
             logging.error(f'ERROR MONITORING DB: {err}')
 
+    async def process_queue_batch(self, documents: list):
+        """Verify whoever in a batch is still queued. The change stream, catch-up, polling and sweeps all come
+        through here one batch at a time, so a user another of them has already cleared is never verified twice."""
+        async with self.queue_lock:
+            queued = set()
+            async for document in database.queue.find({'_id': {'$in': [i['_id'] for i in documents]}}, {'_id': 1}):
+                queued.add(document['_id'])
+            documents = [i for i in documents if i['_id'] in queued]
+            if documents:
+                await self.verify_queue_batch(documents)
+
+    async def verify_queue_batch(self, documents: list):
+        """Verify a batch of queued users concurrently, then clear them from the queue in one go.
+        Users whose role couldn't be added are retried on their own and left queued if they still fail."""
+        users = {}
+        async for user in database.users.find({"_id": {"$in": [i['ref'] for i in documents]}}):
+            users[user['_id']] = user
+            self.user_cache.invalidate(user['discord']['id'])
+            self.name_index.add(user)
+        semaphore = asyncio.Semaphore(VERIFY_CONCURRENCY)
+
+        async def verify(document):
+            user = users.get(document['ref'])
+            if user is None:
+                return document['_id']
+            for attempt in range(VERIFY_ATTEMPTS):
+                async with semaphore:
+                    if await self.set_verified(user['discord']['id']):
+                        logging.info(f'Verified user: {user}')
+                        return document['_id']
+                if attempt < VERIFY_ATTEMPTS - 1:
+                    await asyncio.sleep(2 ** attempt)
+            logging.error(f"Giving up on verifying {user['discord']['id']} after {VERIFY_ATTEMPTS} attempts, leaving them queued for the next sweep")
+            return None
+
+        processed = [i for i in await asyncio.gather(*[verify(i) for i in documents]) if i is not None]
+        if processed:
+            await database.queue.delete_many({'_id': {'$in': processed}})
+
+    @tasks.loop(minutes=QUEUE_RETRY_MINUTES)
+    async def queue_retry_sweep(self):
+        """Retry users still queued after running out of attempts, which the change stream won't see again"""
+        # The first pass would only repeat watch_queue's catch-up
+        if self.queue_retry_sweep.current_loop:
+            await self.process_queue()
+
+    @queue_retry_sweep.before_loop
+    async def before_queue_retry_sweep(self):
+        await self.client.wait_until_ready()
+
+    async def load_resume_token(self):
+        try:
+            state = await database.state.find_one({'_id': 'verify_queue'})
+        except PyMongoError as err:
+            logging.error(f'ERROR LOADING QUEUE RESUME TOKEN: {err}')
+            return None
+        return state.get('resume_token') if state else None
+
+    async def save_resume_token(self, resume_token):
+        try:
+            await database.state.update_one({'_id': 'verify_queue'}, {'$set': {'resume_token': resume_token}}, upsert=True)
+        except PyMongoError as err:
+            logging.error(f'ERROR SAVING QUEUE RESUME TOKEN: {err}')
+
 def setup(client):
     client.add_cog(Verify(client))
+
+
+async def benchmark(entries: int = 5000, discord_seconds: float = 0.01):
+    """Drain a queue of fake users one at a time, as the queue used to be handled, and then in batches.
+    Uses the MongoDB in the bot's config, which should be a local replica set; only the benchmark's own users and
+    queue entries are touched, and they are removed afterwards. Discord is simulated, with each role add and
+    welcome DM taking discord_seconds. Run it with:
+        python -m unity_cogs.verify [entries] [discord seconds]"""
+    cog = Verify.__new__(Verify)
+    cog.user_cache = UserDirectoryCache(max_size=USER_CACHE_SIZE, ttl=USER_CACHE_SECONDS)
+    cog.name_index = TrigramIndex()
+    cog.queue_lock = asyncio.Lock()
+
+    async def set_verified(member_id) -> bool:
+        await asyncio.sleep(discord_seconds)
+        return True
+
+    cog.set_verified = set_verified
+    run_id = f"benchmark-{int(time.time())}"
+
+    async def fill_queue() -> list:
+        users = [{"discord": {"id": f"{run_id}-{i}", "username": f"{run_id}-{i}"}, "reddit": {"name": f"{run_id}-{i}"},
+                  "benchmark": run_id} for i in range(entries)]
+        user_ids = (await database.users.insert_many(users)).inserted_ids
+        await database.queue.insert_many([{"ref": i, "benchmark": run_id} for i in user_ids])
+        return user_ids
+
+    async def sequential(user_ids: list):
+        async for document in database.queue.find({"ref": {"$in": user_ids}}):
+            user = await database.users.find_one({"_id": document['ref']})
+            await set_verified(user['discord']['id'])
+            await database.queue.find_one_and_delete({"_id": document['_id']})
+
+    async def batched(user_ids: list):
+        batch = []
+        async for document in database.queue.find({"ref": {"$in": user_ids}}):
+            batch.append(document)
+            if len(batch) >= QUEUE_BATCH_SIZE:
+                await cog.process_queue_batch(batch)
+                batch = []
+        if batch:
+            await cog.process_queue_batch(batch)
+
+    try:
+        for name, drain in [("One at a time", sequential), ("Batched", batched)]:
+            user_ids = await fill_queue()
+            start = time.perf_counter()
+            await drain(user_ids)
+            elapsed = time.perf_counter() - start
+            left = await database.queue.count_documents({"benchmark": run_id})
+            print(f"{name}: {entries} entries drained in {elapsed:.2f}s ({entries / elapsed:.0f}/s), {left} left queued")
+            await database.queue.delete_many({"benchmark": run_id})
+            await database.users.delete_many({"benchmark": run_id})
+    finally:
+        await database.queue.delete_many({"benchmark": run_id})
+        await database.users.delete_many({"benchmark": run_id})
+
+
+if __name__ == "__main__":
+    # The Motor client is bound to this loop when unity_util.database is imported, so asyncio.run's new loop won't do
+    asyncio.get_event_loop().run_until_complete(benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000,
+                                                          float(sys.argv[2]) if len(sys.argv) > 2 else 0.01))
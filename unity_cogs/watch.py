@@ -0,0 +1,179 @@
+import discord
+import asyncio
+import logging
+import time
+from discord.ext import commands
+from unity_util import bot_config
+from unity_util import database
+from unity_util.keyword_matcher import KeywordMatcher, normalise
+
+MAX_WATCHES_PER_USER = 25
+MAX_KEYWORD_LENGTH = 100
+# Alert DMs sent per second, to stay well clear of Discord's DM spam limits
+ALERTS_PER_SECOND = 5
+
+class Watch(commands.Cog):
+    """Keyword alerts for buy-sell posts.
+    Relies on the limiter cog, which dispatches buy_sell_post for every post it lets through."""
+
+    def __init__(self, client):
+        self.client = client
+        self.matcher = KeywordMatcher()
+        self.matcher_changed = asyncio.Event()
+        # Normalised keyword -> IDs of users watching it, and user ID -> keywords they watch
+        self.watchers = {}
+        self.user_watches = {}
+        self.alert_queue = asyncio.Queue()
+        self.load_watches_task = self.client.loop.create_task(self.load_watches())
+        self.build_matcher_task = self.client.loop.create_task(self.build_matcher())
+        self.send_alerts_task = self.client.loop.create_task(self.send_alerts())
+
+    def cog_unload(self):
+        self.load_watches_task.cancel()
+        self.build_matcher_task.cancel()
+        self.send_alerts_task.cancel()
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        print('Keyword watch cog online')
+
+    @commands.Cog.listener()
+    async def on_buy_sell_post(self, message: discord.Message):
+        keywords = self.matcher.match(message.content)
+        if not keywords:
+            return
+
+        # One alert per watcher, listing every keyword of theirs the post matched
+        alerts = {}
+        for keyword in keywords:
+            for user_id in self.watchers.get(keyword, ()):
+                if user_id != message.author.id:
+                    alerts.setdefault(user_id, []).append(keyword)
+        for user_id, matched in alerts.items():
+            self.alert_queue.put_nowait((user_id, message, sorted(matched)))
+
+# Commands
+
+    @commands.group()
+    async def watch(self, ctx):
+        """Get a DM when a buy-sell post mentions a keyword"""
+        if ctx.invoked_subcommand is None:
+            pass
+
+    @watch.command(aliases=['new'])
+    async def add(self, ctx, *, keyword: str):
+        """Watch buy-sell posts for a keyword or phrase"""
+        keyword = normalise(keyword)
+        if not keyword or len(keyword) > MAX_KEYWORD_LENGTH:
+            embed = discord.Embed(description=f"❌ Keywords must contain letters or numbers and be at most {MAX_KEYWORD_LENGTH} characters", colour=ctx.me.colour)
+            await ctx.send(embed=embed)
+            return
+        watches = self.user_watches.get(ctx.author.id, set())
+        if keyword in watches:
+            embed = discord.Embed(description=f"You're already watching `{keyword}`", colour=ctx.me.colour)
+            await ctx.send(embed=embed)
+            return
+        if len(watches) >= MAX_WATCHES_PER_USER:
+            embed = discord.Embed(description=f"❌ You can watch at most {MAX_WATCHES_PER_USER} keywords. Remove one with `{bot_config.DISCORD_PREFIX}watch remove`", colour=ctx.me.colour)
+            await ctx.send(embed=embed)
+            return
+
+        try:
+            await database.watches.insert_one({'user': str(ctx.author.id), 'keyword': keyword, 'date_added': int(time.time())})
+        except Exception as err:
+            logging.error(f"ERROR ADDING WATCH: {err}")
+            await ctx.send("Couldn't save the keyword for some reason. Please consult the logs for more details")
+            return
+        self.add_watch(ctx.author.id, keyword)
+        embed = discord.Embed(description=f"👀 You'll get a DM when a post in <#{bot_config.BUY_SELL_CHANNEL_ID}> mentions `{keyword}`", colour=ctx.me.colour)
+        await ctx.send(embed=embed)
+
+    @watch.command(aliases=['delete'])
+    async def remove(self, ctx, *, keyword: str):
+        """Stop watching a keyword"""
+        keyword = normalise(keyword)
+        if keyword not in self.user_watches.get(ctx.author.id, set()):
+            embed = discord.Embed(description=f"❌ You aren't watching `{keyword}`", colour=ctx.me.colour)
+            await ctx.send(embed=embed)
+            return
+
+        try:
+            await database.watches.delete_one({'user': str(ctx.author.id), 'keyword': keyword})
+        except Exception as err:
+            logging.error(f"ERROR REMOVING WATCH: {err}")
+            await ctx.send("Couldn't remove the keyword for some reason. Please consult the logs for more details")
+            return
+        self.remove_watch(ctx.author.id, keyword)
+        embed = discord.Embed(description=f"Stopped watching `{keyword}`", colour=ctx.me.colour)
+        await ctx.send(embed=embed)
+
+    @watch.command(name='list')
+    async def list_watches(self, ctx):
+        """List the keywords you are watching"""
+        watches = sorted(self.user_watches.get(ctx.author.id, ()))
+        if not watches:
+            embed = discord.Embed(description="You aren't watching any keywords", colour=ctx.me.colour)
+            await ctx.send(embed=embed)
+            return
+        embed = discord.Embed(title="Watched keywords", description="\n".join(f"`{i}`" for i in watches), colour=ctx.me.colour)
+        await ctx.send(embed=embed)
+
+# Helper functions
+
+    def add_watch(self, user_id: int, keyword: str):
+        self.watchers.setdefault(keyword, set()).add(user_id)
+        self.user_watches.setdefault(user_id, set()).add(keyword)
+        self.matcher.add(keyword)
+        self.matcher_changed.set()
+
+    def remove_watch(self, user_id: int, keyword: str):
+        self.watchers[keyword].discard(user_id)
+        if not self.watchers[keyword]:
+            del self.watchers[keyword]
+        self.user_watches[user_id].discard(keyword)
+        if not self.user_watches[user_id]:
+            del self.user_watches[user_id]
+        self.matcher.remove(keyword)
+        if self.matcher.dirty:
+            self.matcher_changed.set()
+
+    def make_alert_embed(self, message: discord.Message, keywords: list) -> discord.Embed:
+        content = message.content if len(message.content) <= 2000 else message.content[:1997] + "..."
+        embed = discord.Embed(title="New post matching your watched keywords", description=content, colour=message.author.colour)
+        embed.set_author(name=message.author.display_name, icon_url=str(message.author.avatar_url_as(format='png')))
+        embed.add_field(name="Keywords", value=", ".join(f"`{i}`" for i in keywords), inline=True)
+        embed.add_field(name="Message Link", value=f"[Here!]({message.jump_url})", inline=True)
+        return embed
+
+    async def load_watches(self):
+        try:
+            await database.watches.create_index([('user', 1), ('keyword', 1)], unique=True)
+            async for document in database.watches.find({}, {'user': 1, 'keyword': 1}):
+                self.add_watch(int(document['user']), document['keyword'])
+            logging.info(f"Loaded {len(self.matcher)} watched keywords")
+        except Exception as err:
+            logging.error(f"ERROR LOADING WATCHES: {err}")
+
+    async def build_matcher(self):
+        """Recompute the matcher's links in a worker thread whenever keywords are added,
+        so tens of thousands of keywords never hold up message handling"""
+        while True:
+            await self.matcher_changed.wait()
+            self.matcher_changed.clear()
+            await self.client.loop.run_in_executor(None, self.matcher.build)
+
+    async def send_alerts(self):
+        """Send queued alert DMs at a steady rate"""
+        await self.client.wait_until_ready()
+        while True:
+            user_id, message, keywords = await self.alert_queue.get()
+            user = self.client.get_user(user_id)
+            if user is not None:
+                try:
+                    await user.send(embed=self.make_alert_embed(message, keywords))
+                except discord.HTTPException as e:
+                    logging.warning(f"Failed to send watch alert to {user_id}: {e}")
+            await asyncio.sleep(1 / ALERTS_PER_SECOND)
+
+def setup(client):
+    client.add_cog(Watch(client))
@@ -0,0 +1,68 @@
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+# How long to wait for more flair changes to send in the same request
+BATCH_WINDOW_SECONDS = 0.5
+# Reddit's limit on flairs per flair.update request
+MAX_BATCH_SIZE = 100
+
+
+class FlairWorker:
+    """Sets Reddit user flairs from a worker thread, so PRAW's blocking requests never run on the event loop.
+    Changes queued close together are sent as one bulk flair.update request."""
+
+    def __init__(self, subreddit, loop: asyncio.AbstractEventLoop):
+        self.subreddit = subreddit
+        self.loop = loop
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="flair-worker")
+        # Lowercased username -> (flair change, futures waiting on it); newer changes for a user replace older ones
+        self.pending = {}
+        self.changed = asyncio.Event()
+        self.task = self.loop.create_task(self.run())
+
+    def close(self):
+        self.task.cancel()
+        self.executor.shutdown(wait=False)
+        for _, futures in self.pending.values():
+            for future in futures:
+                future.cancel()
+        self.pending.clear()
+
+    async def set_flair(self, username: str, text: str, css_class: str = "") -> bool:
+        """Queue a flair change and wait for Reddit to accept or reject it"""
+        future = self.loop.create_future()
+        key = username.lower()
+        _, futures = self.pending.get(key, (None, []))
+        futures.append(future)
+        self.pending[key] = ({"user": username, "flair_text": text, "flair_css_class": css_class}, futures)
+        self.changed.set()
+        return await future
+
+    async def run(self):
+        while True:
+            await self.changed.wait()
+            await asyncio.sleep(BATCH_WINDOW_SECONDS)
+            self.changed.clear()
+
+            while self.pending:
+                batch = []
+                for key in list(self.pending)[:MAX_BATCH_SIZE]:
+                    batch.append(self.pending.pop(key))
+                await self.send(batch)
+
+    async def send(self, batch: list):
+        changes = [change for change, _ in batch]
+        try:
+            results = await self.loop.run_in_executor(self.executor, self.subreddit.flair.update, changes)
+        except Exception as err:
+            logging.error(f"ERROR SETTING FLAIRS FOR {', '.join(i['user'] for i in changes)}: {err}")
+            results = []
+        results = list(results) + [{"ok": False}] * (len(changes) - len(results))
+
+        for (change, futures), result in zip(batch, results):
+            if not result.get("ok"):
+                logging.error(f"ERROR SETTING FLAIR FOR {change['user']}: {result.get('errors') or result.get('status')}")
+            for future in futures:
+                if not future.done():
+                    future.set_result(bool(result.get("ok")))
@@ -21,12 +21,19 @@ MONGODB_PORT = get_env("MONGODB_PORT", or_else="27017")
 MONGODB_USERNAME = get_env("MONGODB_USERNAME", required=True)
 MONGODB_PASSWORD = get_env("MONGODB_PASSWORD", required=True)
 MONGODB_DATABASE = get_env("MONGODB_DATABASE", or_else="hwsuk")
+MONGODB_MAX_POOL_SIZE = int(get_env("MONGODB_MAX_POOL_SIZE", or_else=20))
+MONGODB_MIN_POOL_SIZE = int(get_env("MONGODB_MIN_POOL_SIZE", or_else=2))
+MONGODB_TIMEOUT_MS = int(get_env("MONGODB_TIMEOUT_MS", or_else=10000))
+MONGODB_READ_PREFERENCE = get_env("MONGODB_READ_PREFERENCE", or_else="primary")
 
 DISCORD_SERVER_ID = get_env("DISCORD_SERVER_ID", required=True)
 DISCORD_TOKEN = get_env("DISCORD_TOKEN", required=True)
 DISCORD_PREFIX = get_env("DISCORD_PREFIX", or_else="!")
 DISCORD_UPDATER_ROLE = get_env("DISCORD_UPDATER_ROLE", or_else="718267453272096778")
 DISCORD_VERIFIED_ROLE = get_env("DISCORD_VERIFIED_ROLE", or_else="292033619197820929")
+VERIFIED_SYNC_ON_STARTUP = get_env("VERIFIED_SYNC_ON_STARTUP", or_else="false").lower() == "true"
+BAN_SYNC_ON_STARTUP = get_env("BAN_SYNC_ON_STARTUP", or_else="false").lower() == "true"
+FLAIR_SYNC_AUTO_APPLY = get_env("FLAIR_SYNC_AUTO_APPLY", or_else="false").lower() == "true"
 
 PRAW_CLIENT_ID = get_env("PRAW_CLIENT_ID", required=True)
 PRAW_CLIENT_SECRET = get_env("PRAW_CLIENT_SECRET", required=True)
@@ -44,9 +51,21 @@ EMBED_REMOVER_CHANNEL_ID = int(get_env("EMBED_REMOVER_CHANNEL_ID", or_else=31267
 BUY_SELL_CHANNEL_ID = int(get_env("BUY_SELL_CHANNEL_ID", required=True))
 BUY_SELL_LIMIT_SECONDS = int(get_env("BUY_SELL_LIMIT_SECONDS", or_else=259200))
 BUY_SELL_BACKUP_DM_CHANNEL_ID = int(get_env("BUY_SELL_BACKUP_DM_CHANNEL_ID", or_else=292032782409007115))
+BUY_SELL_DUPLICATE_ACTION = get_env("BUY_SELL_DUPLICATE_ACTION", or_else="flag")
+BUY_SELL_DUPLICATE_THRESHOLD = float(get_env("BUY_SELL_DUPLICATE_THRESHOLD", or_else=0.8))
+LISTINGS_MAX_AGE_SECONDS = int(get_env("LISTINGS_MAX_AGE_SECONDS", or_else=604800))
 
 DVLA_API_KEY = get_env("DVLA_API_KEY", required=True)
 
+HTTP_TIMEOUT_SECONDS = float(get_env("HTTP_TIMEOUT_SECONDS", or_else=5))
+HTTP_MAX_CONNECTIONS = int(get_env("HTTP_MAX_CONNECTIONS", or_else=20))
+
 REPORT_CHANNEL_ID = int(get_env("REPORT_CHANNEL_ID", or_else="810214651433582633"))
 
+METRICS_PORT = int(get_env("METRICS_PORT", or_else=9200))
+
 LOGGING_FILENAME = get_env("LOGGING_FILENAME", or_else=f'bot-{datetime.now().strftime("%m-%d-%Y-%H%M%S")}.log')
+LOGGING_MAX_BYTES = int(get_env("LOGGING_MAX_BYTES", or_else=10485760))
+LOGGING_BACKUP_COUNT = int(get_env("LOGGING_BACKUP_COUNT", or_else=10))
+LOGGING_ROTATE_WHEN = get_env("LOGGING_ROTATE_WHEN")
+LOGGING_JSON = get_env("LOGGING_JSON", or_else="false").lower() == "true"
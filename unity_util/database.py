@@ -0,0 +1,87 @@
+"""The MongoDB client shared by every cog.
+It lives outside the cogs so reloading one reuses the existing connection pool rather than opening another."""
+from pymongo import monitoring
+import motor.motor_asyncio
+from unity_util import bot_config
+
+
+class PoolStats(monitoring.ConnectionPoolListener):
+    """Counts connection pool events across every server the client talks to"""
+
+    def __init__(self):
+        self.created = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.checkout_failures = 0
+        self.in_use = 0
+
+    def stats(self) -> dict:
+        return {
+            'open': self.created - self.closed,
+            'in_use': self.in_use,
+            'created': self.created,
+            'checked_out': self.checked_out,
+            'checkout_failures': self.checkout_failures,
+            'max_pool_size': bot_config.MONGODB_MAX_POOL_SIZE
+        }
+
+    def connection_created(self, event):
+        self.created += 1
+
+    def connection_closed(self, event):
+        self.closed += 1
+
+    def connection_checked_out(self, event):
+        self.checked_out += 1
+        self.in_use += 1
+
+    def connection_checked_in(self, event):
+        self.in_use -= 1
+
+    def connection_check_out_failed(self, event):
+        self.checkout_failures += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_check_out_started(self, event):
+        pass
+
+
+pool_stats = PoolStats()
+
+mongo = motor.motor_asyncio.AsyncIOMotorClient(
+    host=bot_config.MONGODB_HOST, port=int(bot_config.MONGODB_PORT), replicaSet="rs01",
+    username=bot_config.MONGODB_USERNAME, password=bot_config.MONGODB_PASSWORD,
+    authSource=bot_config.MONGODB_DATABASE, authMechanism='SCRAM-SHA-1',
+    maxPoolSize=bot_config.MONGODB_MAX_POOL_SIZE, minPoolSize=bot_config.MONGODB_MIN_POOL_SIZE,
+    serverSelectionTimeoutMS=bot_config.MONGODB_TIMEOUT_MS, connectTimeoutMS=bot_config.MONGODB_TIMEOUT_MS,
+    readPreference=bot_config.MONGODB_READ_PREFERENCE, event_listeners=[pool_stats]
+)
+db: motor.motor_asyncio.AsyncIOMotorDatabase = mongo[bot_config.MONGODB_DATABASE]
+
+# Collections shared with the verify site
+users: motor.motor_asyncio.AsyncIOMotorCollection = db.users
+queue: motor.motor_asyncio.AsyncIOMotorCollection = db.queue
+# Collections the bot keeps for itself
+state: motor.motor_asyncio.AsyncIOMotorCollection = db.state
+notes: motor.motor_asyncio.AsyncIOMotorCollection = db.notes
+reports: motor.motor_asyncio.AsyncIOMotorCollection = db.reports
+watches: motor.motor_asyncio.AsyncIOMotorCollection = db.watches
+listings: motor.motor_asyncio.AsyncIOMotorCollection = db.listings
+limiter_posts: motor.motor_asyncio.AsyncIOMotorCollection = db.limiter_posts
+limiter_whitelist: motor.motor_asyncio.AsyncIOMotorCollection = db.limiter_whitelist
+
+
+def close():
+    """Close every pooled connection; call once the bot has stopped"""
+    mongo.close()
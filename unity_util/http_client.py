@@ -0,0 +1,71 @@
+"""The HTTP client shared by every cog and service.
+Connections are pooled per host and kept alive between requests, so repeat lookups skip the TCP and TLS handshakes.
+HTTP/2 is negotiated with hosts that offer it."""
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import httpx
+from unity_util import bot_config
+
+# How long an idle connection is kept open for the next request
+KEEPALIVE_SECONDS = 60
+
+client = httpx.AsyncClient(
+    http2=True,
+    timeout=httpx.Timeout(bot_config.HTTP_TIMEOUT_SECONDS),
+    limits=httpx.Limits(max_connections=bot_config.HTTP_MAX_CONNECTIONS,
+                        max_keepalive_connections=bot_config.HTTP_MAX_CONNECTIONS,
+                        keepalive_expiry=KEEPALIVE_SECONDS)
+)
+
+
+class UpstreamStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.ttfb_seconds = 0.0
+        self.total_seconds = 0.0
+        self.max_total_seconds = 0.0
+
+    def as_dict(self) -> dict:
+        completed = self.requests - self.errors
+        return {
+            'requests': self.requests,
+            'errors': self.errors,
+            'avg_ttfb_ms': self.ttfb_seconds / completed * 1000 if completed else 0.0,
+            'avg_total_ms': self.total_seconds / completed * 1000 if completed else 0.0,
+            'max_total_ms': self.max_total_seconds * 1000
+        }
+
+
+# Host -> request timings
+upstream_stats = defaultdict(UpstreamStats)
+
+
+async def get(url: str, **kwargs) -> httpx.Response:
+    """GET url through the shared client and return the fully read response, recording its timings against the host.
+    Time to first byte includes connecting, so a fall in it is where reused connections show up."""
+    stats = upstream_stats[urlsplit(url).hostname]
+    stats.requests += 1
+    start = time.perf_counter()
+    try:
+        async with client.stream('GET', url, **kwargs) as response:
+            ttfb = time.perf_counter() - start
+            await response.aread()
+    except httpx.HTTPError:
+        stats.errors += 1
+        raise
+    total = time.perf_counter() - start
+    stats.ttfb_seconds += ttfb
+    stats.total_seconds += total
+    stats.max_total_seconds = max(stats.max_total_seconds, total)
+    return response
+
+
+def stats() -> dict:
+    return {host: i.as_dict() for host, i in upstream_stats.items()}
+
+
+async def close():
+    await client.aclose()
@@ -0,0 +1,130 @@
+"""Aho-Corasick automaton for matching a post against every watched keyword in one pass."""
+import re
+from collections import deque
+from typing import Set
+
+TOKEN_REGEX = re.compile(r"[a-z0-9£]+")
+
+
+def normalise(text: str) -> str:
+    """Lowercase text and collapse punctuation and whitespace into single spaces, so keyword
+    boundaries are always spaces or the ends of the string"""
+    return " ".join(TOKEN_REGEX.findall(text.lower()))
+
+
+class KeywordMatcher:
+    """Keywords are added to and removed from the trie as they change, and failure links are
+    recomputed by build() in one breadth-first pass after a batch of additions.
+
+    build() can run in a worker thread while posts are matched on the event loop: every failure
+    and output link always points at a node that spells a suffix of the text read so far, so a
+    match found mid-build is always real, but keywords added since the last build may be missed
+    until it finishes."""
+
+    def __init__(self):
+        self.goto = [{}]
+        self.fail = [0]
+        # Keyword ending at each node, or None
+        self.keywords = [None]
+        # Nearest node along the failure chain that ends a keyword (0 if none)
+        self.output = [0]
+        # Keyword -> number of subscriptions using it
+        self.refcounts = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.refcounts)
+
+    def __contains__(self, keyword: str):
+        return normalise(keyword) in self.refcounts
+
+    def add(self, keyword: str):
+        keyword = normalise(keyword)
+        if not keyword:
+            return
+        self.refcounts[keyword] = self.refcounts.get(keyword, 0) + 1
+        if self.refcounts[keyword] > 1:
+            return
+
+        node = 0
+        for char in keyword:
+            next_node = self.goto[node].get(char)
+            if next_node is None:
+                next_node = len(self.goto)
+                self.goto[node][char] = next_node
+                self.goto.append({})
+                self.fail.append(0)
+                self.keywords.append(None)
+                self.output.append(0)
+            node = next_node
+        self.keywords[node] = keyword
+        self.dirty = True
+
+    def remove(self, keyword: str):
+        keyword = normalise(keyword)
+        count = self.refcounts.get(keyword, 0)
+        if count > 1:
+            self.refcounts[keyword] = count - 1
+            return
+        if count == 0:
+            return
+
+        del self.refcounts[keyword]
+        # Leave the trie nodes in place; output chains skip nodes whose keyword was removed
+        node = 0
+        for char in keyword:
+            node = self.goto[node][char]
+        self.keywords[node] = None
+        if len(self.goto) > 4 * (sum(len(k) for k in self.refcounts) + 1):
+            self.compact()
+
+    def compact(self):
+        """Rebuild the trie from the live keywords once removed keywords make up most of it"""
+        refcounts = self.refcounts
+        self.__init__()
+        for keyword, count in refcounts.items():
+            self.add(keyword)
+            self.refcounts[keyword] = count
+
+    def build(self):
+        """Recompute failure and output links breadth first"""
+        self.dirty = False
+        # Hold on to the current lists in case compact() replaces them mid-build
+        goto, fail, keywords, output = self.goto, self.fail, self.keywords, self.output
+        queue = deque()
+        for node in list(goto[0].values()):
+            fail[node] = 0
+            output[node] = 0
+            queue.append(node)
+
+        while queue:
+            node = queue.popleft()
+            for char, child in list(goto[node].items()):
+                fallback = fail[node]
+                while fallback and char not in goto[fallback]:
+                    fallback = fail[fallback]
+                link = goto[fallback].get(char, 0)
+                output[child] = link if keywords[link] is not None else output[link]
+                fail[child] = link
+                queue.append(child)
+
+    def match(self, text: str) -> Set[str]:
+        """Find every keyword that appears in the text as whole words"""
+        goto, fail, keywords, output = self.goto, self.fail, self.keywords, self.output
+        text = normalise(text)
+        found = set()
+        node = 0
+        for end, char in enumerate(text):
+            while node and char not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(char, 0)
+
+            candidate = node
+            while candidate:
+                keyword = keywords[candidate]
+                if keyword is not None and keyword not in found:
+                    start = end - len(keyword) + 1
+                    if (start == 0 or text[start - 1] == " ") and (end + 1 == len(text) or text[end + 1] == " "):
+                        found.add(keyword)
+                candidate = output[candidate]
+        return found
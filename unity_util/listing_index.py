@@ -0,0 +1,96 @@
+"""Parsing of buy-sell posts into listing records, and an inverted index to search them by term."""
+import re
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import List
+
+TOKEN_REGEX = re.compile(r"[a-z0-9]+")
+# [H] ... [W] ... style posts
+BRACKETED_REGEX = re.compile(r"\[\s*h\s*\](?P<have>.*?)(?:\[\s*w\s*\](?P<want>.*))?$", re.IGNORECASE | re.DOTALL)
+# Have: ... Want: ... style posts
+LABELLED_REGEX = re.compile(r"\bhave\s*:(?P<have>.*?)(?:\bwant\s*:(?P<want>.*))?$", re.IGNORECASE | re.DOTALL)
+PRICE_REGEX = re.compile(r"£\s?(\d[\d,]*(?:\.\d{1,2})?)|\b(\d[\d,]*(?:\.\d{1,2})?)\s?(?:gbp|quid|pounds)\b", re.IGNORECASE)
+STOP_WORDS = frozenset(['a', 'an', 'and', 'the', 'for', 'or', 'of', 'to', 'in', 'on', 'with', 'h', 'w', 'have', 'want', 'wtb', 'wts'])
+
+
+def tokenise(text: str) -> List[str]:
+    return [i for i in TOKEN_REGEX.findall(text.lower()) if i not in STOP_WORDS]
+
+
+def parse_listing(content: str) -> dict:
+    """Split a post into what the author has and wants, the terms to index it by and any prices in it"""
+    match = BRACKETED_REGEX.search(content) or LABELLED_REGEX.search(content)
+    if match:
+        have, want = match.group('have').strip(), (match.group('want') or '').strip()
+    else:
+        have, want = content.strip(), ''
+
+    prices = []
+    for match in PRICE_REGEX.finditer(content):
+        price = float((match.group(1) or match.group(2)).replace(',', ''))
+        if price not in prices:
+            prices.append(price)
+
+    return {'have': have, 'want': want, 'tokens': sorted(set(tokenise(content))), 'prices': prices}
+
+
+class ListingIndex:
+    """Listing records keyed by message ID, with a token -> message IDs inverted index.
+    Records must be added roughly oldest first, as eviction walks them in insertion order."""
+
+    def __init__(self, max_age: timedelta):
+        self.max_age = max_age
+        self.records = OrderedDict()
+        self.postings = {}
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, record: dict):
+        self.remove(record['_id'])
+        self.records[record['_id']] = record
+        for token in record['tokens']:
+            self.postings.setdefault(token, set()).add(record['_id'])
+
+    def update(self, record: dict):
+        """Replace an indexed record, e.g. after an edit, keeping its place in the eviction order"""
+        previous = self.records.get(record['_id'])
+        if previous is None:
+            return
+        self.remove_postings(previous)
+        self.records[record['_id']] = record
+        for token in record['tokens']:
+            self.postings.setdefault(token, set()).add(record['_id'])
+
+    def remove(self, message_id: str):
+        record = self.records.pop(message_id, None)
+        if record is not None:
+            self.remove_postings(record)
+
+    def remove_postings(self, record: dict):
+        for token in record['tokens']:
+            message_ids = self.postings[token]
+            message_ids.discard(record['_id'])
+            if not message_ids:
+                del self.postings[token]
+
+    def evict(self, now: datetime):
+        while self.records:
+            message_id, record = next(iter(self.records.items()))
+            if now - record['created_at'] <= self.max_age:
+                break
+            self.remove(message_id)
+
+    def search(self, terms: str, limit: int = 10) -> List[dict]:
+        """Find the newest listings containing every term"""
+        tokens = set(tokenise(terms))
+        if not tokens:
+            return []
+        postings = sorted((self.postings.get(token, set()) for token in tokens), key=len)
+        matches = set(postings[0])
+        for message_ids in postings[1:]:
+            matches &= message_ids
+            if not matches:
+                return []
+        records = sorted((self.records[i] for i in matches), key=lambda record: record['created_at'], reverse=True)
+        return records[:limit]
@@ -0,0 +1,120 @@
+"""Logging for the whole bot, set up once by bot.py.
+Log calls on the event loop only put the record on a queue; a background thread formats it and writes it out
+to stdout and a rotated log file.
+
+Run this module directly to compare the cost of a log call with and without the queue:
+    python -m unity_util.log_config [calls]
+"""
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import tempfile
+import time
+
+TEXT_FORMAT = "[%(levelname)s]\t %(name)s: %(message)s"
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, for shipping logs somewhere that can search them"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': self.formatTime(record, "%Y-%m-%dT%H:%M:%S"),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        # RecordQueueHandler has already turned the traceback into exc_text by the time it gets here
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        elif record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry)
+
+
+class RecordQueueHandler(logging.handlers.QueueHandler):
+    """Only resolves the message on the caller's side; the listener's handlers do the formatting"""
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class SyncedFileHandler(logging.FileHandler):
+    """Forces every record to disk, standing in for a slow or busy disk in the benchmark"""
+
+    def flush(self):
+        super().flush()
+        if self.stream:
+            os.fsync(self.stream.fileno())
+
+
+def make_file_handler(path: str, max_bytes: int, backup_count: int, rotate_when: str = None) -> logging.Handler:
+    """Rotate by time if rotate_when is set (e.g. 'midnight'), otherwise by size"""
+    if rotate_when:
+        return logging.handlers.TimedRotatingFileHandler(path, when=rotate_when, backupCount=backup_count, encoding='utf-8')
+    return logging.handlers.RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backup_count, encoding='utf-8')
+
+
+def setup_logging(path: str, max_bytes: int, backup_count: int, rotate_when: str = None,
+                  json_format: bool = False, level: int = logging.INFO) -> logging.handlers.QueueListener:
+    """Route every logger through a queue to stdout and a rotated file.
+    Returns the started listener, which must be stopped on shutdown to flush what's left in the queue."""
+    formatter = JsonFormatter() if json_format else logging.Formatter(TEXT_FORMAT)
+    handlers = [logging.StreamHandler(sys.stdout), make_file_handler(path, max_bytes, backup_count, rotate_when)]
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, *handlers, respect_handler_level=True)
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(RecordQueueHandler(records))
+    root.setLevel(level)
+    listener.start()
+    return listener
+
+
+def benchmark(calls: int = 5000):
+    """Time log calls as the event loop sees them, writing straight to a file and through the queue,
+    to both a normal file and one synced on every write"""
+    def time_calls(logger) -> float:
+        start = time.perf_counter()
+        for i in range(calls):
+            logger.info(f"Message {i} from the benchmark")
+        return (time.perf_counter() - start) / calls * 1e6
+
+    with tempfile.TemporaryDirectory() as directory:
+        for handler_class in [logging.FileHandler, SyncedFileHandler]:
+            results = []
+            for queued in [False, True]:
+                logger = logging.getLogger(f"benchmark.{handler_class.__name__}.{queued}")
+                logger.propagate = False
+                logger.setLevel(logging.INFO)
+                handler = handler_class(os.path.join(directory, f"{handler_class.__name__}-{queued}.log"))
+                handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+                listener = None
+                if queued:
+                    records = queue.SimpleQueue()
+                    listener = logging.handlers.QueueListener(records, handler)
+                    logger.addHandler(RecordQueueHandler(records))
+                    listener.start()
+                else:
+                    logger.addHandler(handler)
+                results.append(time_calls(logger))
+                if listener:
+                    listener.stop()
+                handler.close()
+            print(f"{handler_class.__name__}: {results[0]:.1f} µs per call direct, {results[1]:.1f} µs through the queue")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 5000)
@@ -0,0 +1,190 @@
+"""Routes each message only to the handlers registered for its channel or content, instead of every cog's on_message.
+Each route has its own small pool of workers and a bounded backlog, so a slow handler sheds its own load
+rather than piling up tasks or holding up other routes.
+Routes that enforce rules can opt out of shedding, so every message still reaches them however far behind they are.
+
+Run this module directly to measure the cost of routing a message:
+    python -m unity_util.message_router [messages]
+"""
+import asyncio
+import logging
+import re
+import sys
+import time
+from collections import defaultdict
+from types import SimpleNamespace
+from typing import Awaitable, Callable
+
+from unity_util import metrics
+
+# Seconds between warnings about a route dropping messages
+SHED_WARNING_INTERVAL = 60
+
+
+class Route:
+    def __init__(self, name: str, handler: Callable[..., Awaitable], channel_id: int = None, predicate: Callable[[str], bool] = None,
+                 ignore_bots: bool = True, workers: int = 4, max_pending: int = 100, shed_load: bool = True,
+                 loop: asyncio.AbstractEventLoop = None):
+        self.name = name
+        self.handler = handler
+        self.channel_id = channel_id
+        self.predicate = predicate
+        self.ignore_bots = ignore_bots
+        self.max_pending = max_pending
+        # Without shedding the backlog is unbounded, and max_pending only sets when to warn about it
+        self.queue = asyncio.Queue(maxsize=max_pending if shed_load else 0)
+        self.dropped = 0
+        self.last_shed_warning = 0.0
+        loop = loop or asyncio.get_event_loop()
+        self.tasks = [loop.create_task(self.work()) for _ in range(workers)]
+
+    def matches(self, message) -> bool:
+        if self.ignore_bots and message.author.bot:
+            return False
+        return self.predicate is None or bool(self.predicate(message.content))
+
+    def submit(self, message):
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            self.warn_backed_up(f"{self.dropped} messages dropped so far")
+            return
+        if self.queue.maxsize == 0 and self.queue.qsize() > self.max_pending:
+            self.warn_backed_up(f"{self.queue.qsize()} messages waiting")
+
+    def warn_backed_up(self, detail: str):
+        now = time.monotonic()
+        if now - self.last_shed_warning > SHED_WARNING_INTERVAL:
+            self.last_shed_warning = now
+            logging.warning(f"Message route {self.name} is backed up, {detail}")
+
+    async def work(self):
+        while True:
+            message = await self.queue.get()
+            start = time.perf_counter()
+            failed = True
+            try:
+                await self.handler(message)
+                failed = False
+            except Exception as err:
+                logging.error(f"ERROR IN MESSAGE ROUTE {self.name} FOR MESSAGE {message.id}: {err}")
+            finally:
+                metrics.observe('route', self.name, time.perf_counter() - start, failed)
+                self.queue.task_done()
+
+    def close(self):
+        for task in self.tasks:
+            task.cancel()
+
+
+class MessageRouter:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop = None):
+        self.loop = loop
+        # Channel ID -> routes for that channel; routes without a channel are checked for every message
+        self.by_channel = defaultdict(list)
+        self.anywhere = []
+
+    def add_route(self, name: str, handler: Callable[..., Awaitable], channel_id: int = None,
+                  predicate: Callable[[str], bool] = None, **kwargs) -> Route:
+        """Send matching messages to handler. Messages from bots are skipped unless ignore_bots=False.
+        Pass workers and max_pending to size the route's pool and backlog,
+        and shed_load=False for a route that must see every message rather than drop them when backed up."""
+        route = Route(name, handler, channel_id=channel_id, predicate=predicate, loop=self.loop, **kwargs)
+        if channel_id is None:
+            self.anywhere.append(route)
+        else:
+            self.by_channel[channel_id].append(route)
+        return route
+
+    def remove_route(self, route: Route):
+        route.close()
+        if route.channel_id is None:
+            self.anywhere.remove(route)
+        else:
+            self.by_channel[route.channel_id].remove(route)
+            if not self.by_channel[route.channel_id]:
+                del self.by_channel[route.channel_id]
+
+    def routes(self) -> list:
+        return [route for routes in self.by_channel.values() for route in routes] + self.anywhere
+
+    def dispatch(self, message):
+        for route in self.by_channel.get(message.channel.id, ()):
+            if route.matches(message):
+                route.submit(message)
+        for route in self.anywhere:
+            if route.matches(message):
+                route.submit(message)
+
+    async def on_message(self, message):
+        self.dispatch(message)
+
+
+def contains(pattern: str) -> Callable[[str], bool]:
+    """A precompiled case-insensitive content predicate"""
+    return re.compile(re.escape(pattern), re.IGNORECASE).search
+
+
+def benchmark(messages: int = 200000):
+    async def run():
+        async def handler(message):
+            pass
+
+        router = MessageRouter()
+        for channel_id in range(20):
+            router.add_route(f"channel-{channel_id}", handler, channel_id=channel_id, max_pending=messages)
+        router.add_route("cex-links", handler, predicate=contains("https://uk.webuy.com/"), max_pending=messages)
+
+        author = SimpleNamespace(id=1, bot=False)
+        batch = [
+            SimpleNamespace(id=i, author=author, channel=SimpleNamespace(id=i % 40),
+                            content="Selling a GPU, see https://uk.webuy.com/product-detail?id=123" if i % 50 == 0
+                            else "Anyone got a spare 650W PSU they'd part with? Collection from Leeds")
+            for i in range(messages)
+        ]
+        start = time.perf_counter()
+        for message in batch:
+            router.dispatch(message)
+        routed = time.perf_counter() - start
+        queued = sum(route.queue.qsize() for route in router.routes())
+        for route in router.routes():
+            await route.queue.join()
+        handled = time.perf_counter() - start
+        print(f"Router: {routed / messages * 1e6:.2f} µs per message to route, {handled / messages * 1e6:.2f} µs including handlers, "
+              f"{queued} handler calls for {messages} messages")
+
+        # What every cog having its own on_message costs: a task per listener per message, most returning straight away
+        async def listener(message):
+            if message.author.bot or message.channel.id != 0:
+                return
+
+        loop = asyncio.get_event_loop()
+        start = time.perf_counter()
+        tasks = [loop.create_task(listener(message)) for message in batch for _ in range(4)]
+        await asyncio.gather(*tasks)
+        fanned = time.perf_counter() - start
+        print(f"Four on_message listeners: {fanned / messages * 1e6:.2f} µs per message, {len(tasks)} handler calls")
+
+        slow = MessageRouter()
+
+        async def slow_handler(message):
+            await asyncio.sleep(1)
+
+        route = slow.add_route("slow", slow_handler, channel_id=0, workers=2, max_pending=100)
+        for message in batch[:10000]:
+            slow.dispatch(message)
+        print(f"Slow route fed 250 messages: {route.queue.qsize()} queued, {route.dropped} shed")
+        route = slow.add_route("slow-enforcing", slow_handler, channel_id=0, workers=2, max_pending=100, shed_load=False)
+        for message in batch[:10000]:
+            slow.dispatch(message)
+        print(f"Slow route that doesn't shed fed 250 messages: {route.queue.qsize()} queued, {route.dropped} shed")
+        for route in router.routes() + slow.routes():
+            route.close()
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 200000)
@@ -0,0 +1,162 @@
+"""Call counts, error counts and latency histograms for every command and listener.
+Histograms use fixed buckets, so recording a call is a bisect and two increments.
+They are served in the Prometheus text format on localhost and summarised by the !stats command.
+
+Run this module directly to measure the cost of recording a call:
+    python -m unity_util.metrics
+"""
+import asyncio
+import functools
+import logging
+import time
+from bisect import bisect_left
+
+# Upper bounds of the latency buckets in seconds; anything slower lands in a final +Inf bucket
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    __slots__ = ('counts', 'count', 'errors', 'total')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+
+    def observe(self, seconds: float, failed: bool = False):
+        self.counts[bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if failed:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within the bucket it falls in"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        cumulative = 0
+        for i, count in enumerate(self.counts):
+            if cumulative + count >= rank and count:
+                lower = BUCKETS[i - 1] if i > 0 else 0.0
+                upper = BUCKETS[i] if i < len(BUCKETS) else BUCKETS[-1]
+                return lower + (upper - lower) * (rank - cumulative) / count
+            cumulative += count
+        return BUCKETS[-1]
+
+
+# (kind, name) -> histogram, where kind is 'command' or 'listener'
+histograms = {}
+
+
+def observe(kind: str, name: str, seconds: float, failed: bool = False):
+    histogram = histograms.get((kind, name))
+    if histogram is None:
+        histogram = histograms[(kind, name)] = Histogram()
+    histogram.observe(seconds, failed)
+
+
+def listener_name(func) -> str:
+    owner = getattr(func, '__self__', None)
+    return f"{type(owner).__name__}.{func.__name__}" if owner is not None else func.__name__
+
+
+def timed_listener(func):
+    """Wrap a listener coroutine so each call is recorded, failing or not"""
+    name = listener_name(func)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        failed = True
+        try:
+            result = await func(*args, **kwargs)
+            failed = False
+            return result
+        finally:
+            observe('listener', name, time.perf_counter() - start, failed)
+
+    return wrapper
+
+
+def summary() -> list:
+    """(kind, name, count, errors, p50, p95, p99) for everything recorded, busiest first"""
+    rows = [
+        (kind, name, i.count, i.errors, i.quantile(0.5), i.quantile(0.95), i.quantile(0.99))
+        for (kind, name), i in histograms.items()
+    ]
+    return sorted(rows, key=lambda i: i[2], reverse=True)
+
+
+def prometheus_text() -> str:
+    lines = [
+        "# HELP discord_bot_handler_seconds Time taken by commands and listeners",
+        "# TYPE discord_bot_handler_seconds histogram"
+    ]
+    errors = [
+        "# HELP discord_bot_handler_errors_total Commands and listeners that failed",
+        "# TYPE discord_bot_handler_errors_total counter"
+    ]
+    for (kind, name), histogram in sorted(histograms.items()):
+        labels = f'kind="{kind}",name="{name}"'
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+            cumulative += count
+            lines.append(f'discord_bot_handler_seconds_bucket{{{labels},le="{bound}"}} {cumulative}')
+        lines.append(f'discord_bot_handler_seconds_sum{{{labels}}} {histogram.total}')
+        lines.append(f'discord_bot_handler_seconds_count{{{labels}}} {histogram.count}')
+        errors.append(f'discord_bot_handler_errors_total{{{labels}}} {histogram.errors}')
+    return "\n".join(lines + errors) + "\n"
+
+
+async def handle_request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1] == '/metrics':
+            status, body = "200 OK", prometheus_text().encode()
+        else:
+            status, body = "404 Not Found", b"Not found\n"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+
+
+async def serve(port: int):
+    """Serve /metrics on localhost only"""
+    try:
+        server = await asyncio.start_server(handle_request, host='127.0.0.1', port=port)
+    except OSError as err:
+        logging.error(f"ERROR STARTING METRICS SERVER ON PORT {port}: {err}")
+        return
+    logging.info(f"Serving metrics on http://127.0.0.1:{port}/metrics")
+    async with server:
+        await server.serve_forever()
+
+
+def benchmark(calls: int = 200000):
+    async def listener():
+        pass
+
+    wrapped = timed_listener(listener)
+
+    async def run(func) -> float:
+        start = time.perf_counter()
+        for _ in range(calls):
+            await func()
+        return (time.perf_counter() - start) / calls * 1e6
+
+    plain = asyncio.run(run(listener))
+    timed = asyncio.run(run(wrapped))
+    print(f"Listener call: {plain:.2f} µs bare, {timed:.2f} µs recorded ({timed - plain:.2f} µs overhead)")
+
+
+if __name__ == "__main__":
+    benchmark()
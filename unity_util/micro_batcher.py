@@ -0,0 +1,98 @@
+"""Collects items submitted close together into batches, so a burst costs one round trip per batch.
+
+Run this module directly to replay a synthetic burst against a simulated database:
+    python -m unity_util.micro_batcher [items] [burst seconds]
+"""
+import asyncio
+import random
+import sys
+import time
+from typing import Awaitable, Callable, List
+
+
+class MicroBatcher:
+    """A batch is handed to the handler once it has max_size items or its first item has waited max_delay seconds.
+    submit() returns once the handler has finished with the item's batch."""
+
+    def __init__(self, handler: Callable[[List], Awaitable], max_size: int = 100, max_delay: float = 0.25,
+                 loop: asyncio.AbstractEventLoop = None):
+        self.handler = handler
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.loop = loop or asyncio.get_event_loop()
+        # (item, future resolved when its batch is handled)
+        self.pending = []
+        self.timer = None
+        self.running = set()
+
+    async def submit(self, item):
+        future = self.loop.create_future()
+        self.pending.append((item, future))
+        if len(self.pending) >= self.max_size:
+            self.flush()
+        elif self.timer is None:
+            self.timer = self.loop.call_later(self.max_delay, self.flush)
+        return await future
+
+    def flush(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        batch, self.pending = self.pending, []
+        if batch:
+            task = self.loop.create_task(self.run(batch))
+            self.running.add(task)
+            task.add_done_callback(self.running.discard)
+
+    async def run(self, batch: list):
+        try:
+            await self.handler([item for item, _ in batch])
+        except Exception as err:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(err)
+        else:
+            for _, future in batch:
+                if not future.done():
+                    future.set_result(None)
+
+    def close(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        for _, future in self.pending:
+            future.cancel()
+        self.pending = []
+        for task in self.running:
+            task.cancel()
+
+
+async def load_test(items: int = 1000, burst_seconds: float = 2.0, query_seconds: float = 0.005):
+    """Submit items at random over burst_seconds, with every batch costing one simulated query"""
+    round_trips = 0
+
+    async def handler(batch):
+        nonlocal round_trips
+        round_trips += 1
+        await asyncio.sleep(query_seconds)
+
+    batcher = MicroBatcher(handler)
+    latencies = []
+
+    async def join(delay):
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        await batcher.submit(object())
+        latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[join(random.uniform(0, burst_seconds)) for _ in range(items)])
+    latencies.sort()
+    print(f"{items} joins over {burst_seconds}s: {round_trips} database round trips (vs {items} unbatched)")
+    print(f"latency p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, "
+          f"p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f} ms, "
+          f"max {latencies[-1] * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(load_test(int(sys.argv[1]) if len(sys.argv) > 1 else 1000,
+                          float(sys.argv[2]) if len(sys.argv) > 2 else 2.0))
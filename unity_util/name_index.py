@@ -0,0 +1,117 @@
+"""In-memory trigram index over verified users' Reddit names and Discord usernames, for "did you mean" suggestions.
+
+Run this module directly to benchmark it against synthetic users:
+    python -m unity_util.name_index [users]
+"""
+import random
+import string
+import sys
+import time
+from collections import Counter, defaultdict
+
+from fuzzywuzzy import fuzz
+
+# Indexed name fields and how they are shown in suggestions
+NAME_FIELDS = {'reddit.name': 'Reddit', 'discord.username': 'Discord'}
+# Entries sharing the most trigrams with a query that are rescored with fuzzywuzzy
+RESCORE_CANDIDATES = 50
+
+
+def trigrams(name: str) -> set:
+    padded = f"  {name.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """Candidates are the names sharing the most trigrams with the query, which are then ranked by edit distance.
+    A query only touches the postings of its own trigrams, never the whole index."""
+
+    def __init__(self):
+        # Trigram -> entries containing it; an entry is (discord ID, field, name)
+        self.postings = defaultdict(set)
+        # Discord ID -> that user's entries
+        self.entries_by_id = {}
+
+    def __len__(self):
+        return len(self.entries_by_id)
+
+    def add(self, user: dict):
+        """Index a user document's names, replacing any indexed before"""
+        discord_id = str(user['discord']['id'])
+        self.remove(discord_id)
+        entries = []
+        for field in NAME_FIELDS:
+            section, key = field.split('.')
+            name = user.get(section, {}).get(key)
+            if not name:
+                continue
+            entry = (discord_id, field, str(name))
+            entries.append(entry)
+            for trigram in trigrams(entry[2]):
+                self.postings[trigram].add(entry)
+        self.entries_by_id[discord_id] = entries
+
+    def remove(self, discord_id):
+        for entry in self.entries_by_id.pop(str(discord_id), ()):
+            for trigram in trigrams(entry[2]):
+                posting = self.postings.get(trigram)
+                if posting is not None:
+                    posting.discard(entry)
+                    if not posting:
+                        del self.postings[trigram]
+
+    def search(self, query: str, limit: int = 5, min_score: int = 60) -> list:
+        """Get up to limit (discord ID, field, name, score) matches, best first, at most one per user"""
+        query_trigrams = trigrams(query)
+        shared = Counter()
+        for trigram in query_trigrams:
+            shared.update(self.postings.get(trigram, ()))
+        if not shared:
+            return []
+
+        # Rank by Dice coefficient so long names sharing a few trigrams by chance don't crowd out close matches
+        def dice(entry):
+            return 2 * shared[entry] / (len(query_trigrams) + len(entry[2]) + 1)
+
+        candidates = sorted(shared, key=dice, reverse=True)[:RESCORE_CANDIDATES]
+        query = query.lower()
+        best = {}
+        for discord_id, field, name in candidates:
+            score = fuzz.ratio(query, name.lower())
+            if score >= min_score and score > best.get(discord_id, (None, None, None, -1))[3]:
+                best[discord_id] = (discord_id, field, name, score)
+        return sorted(best.values(), key=lambda i: i[3], reverse=True)[:limit]
+
+
+def benchmark(users: int = 50000, queries: int = 1000):
+    random.seed(0)
+
+    def random_name():
+        return ''.join(random.choice(string.ascii_lowercase + string.digits + '_') for _ in range(random.randint(5, 16)))
+
+    def typo(name):
+        i = random.randrange(len(name))
+        return name[:i] + random.choice(string.ascii_lowercase) + name[i + 1:]
+
+    documents = [
+        {'discord': {'id': str(10 ** 17 + i), 'username': random_name()}, 'reddit': {'name': random_name()}}
+        for i in range(users)
+    ]
+    index = TrigramIndex()
+    start = time.perf_counter()
+    for document in documents:
+        index.add(document)
+    print(f"Indexed {users} users in {time.perf_counter() - start:.2f}s")
+
+    targets = random.sample(documents, queries)
+    start = time.perf_counter()
+    found = 0
+    for document in targets:
+        results = index.search(typo(document['reddit']['name']))
+        found += any(i[0] == document['discord']['id'] for i in results)
+    elapsed = time.perf_counter() - start
+    print(f"{queries} misspelt searches: {elapsed / queries * 1000:.2f} ms each, intended user suggested for {found / queries:.0%}")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 50000)
@@ -0,0 +1,158 @@
+"""Sliding-window MinHash/LSH index used to spot near-duplicate posts from different authors.
+
+Run this module directly to benchmark the per-message cost at a given index size:
+    python -m unity_util.near_duplicates [indexed posts]
+"""
+import random
+import re
+import sys
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Optional, Tuple
+
+# Signature slots; a power of two so a hash splits cleanly into slot and value bits
+SIGNATURE_SIZE = 32
+BANDS = 8
+ROWS = SIGNATURE_SIZE // BANDS
+# Posts shorter than this are too generic ("wtb 3080 fe") to call duplicates
+MIN_TOKENS = 5
+
+_MASK = (1 << 64) - 1
+_SLOT_BITS = SIGNATURE_SIZE.bit_length() - 1
+_EMPTY = _MASK
+# Added per slot of distance when an empty slot borrows its neighbour's value
+_DENSIFY_OFFSET = 1 << 60
+TOKEN_REGEX = re.compile(r"[a-z0-9£]+(?:[.,][0-9]+)*")
+
+
+def make_signature(content: str) -> Optional[Tuple[int]]:
+    """Get the MinHash signature of a post's word bigrams, or None if it's too short to compare"""
+    tokens = TOKEN_REGEX.findall(content.lower())
+    if len(tokens) < MIN_TOKENS:
+        return None
+    # One permutation MinHash: hash every bigram once, use the low bits to pick a slot
+    # and keep the minimum of the remaining bits in each slot
+    slots = [_EMPTY] * SIGNATURE_SIZE
+    for i in range(len(tokens) - 1):
+        h = hash((tokens[i], tokens[i + 1])) & _MASK
+        slot = h & (SIGNATURE_SIZE - 1)
+        value = h >> _SLOT_BITS
+        if value < slots[slot]:
+            slots[slot] = value
+
+    # Short posts leave some slots empty; fill them from the next non-empty slot (rotation densification)
+    signature = list(slots)
+    for slot in range(SIGNATURE_SIZE):
+        if slots[slot] == _EMPTY:
+            distance = 1
+            while slots[(slot + distance) % SIGNATURE_SIZE] == _EMPTY:
+                distance += 1
+            signature[slot] = slots[(slot + distance) % SIGNATURE_SIZE] + distance * _DENSIFY_OFFSET
+    return tuple(signature)
+
+
+def similarity(a: Tuple[int], b: Tuple[int]) -> float:
+    """Estimate the Jaccard similarity of two posts from their signatures"""
+    return sum(x == y for x, y in zip(a, b)) / SIGNATURE_SIZE
+
+
+class NearDuplicateIndex:
+    """Recent post signatures, bucketed by LSH band so lookups only compare likely matches.
+    Entries are evicted once they are older than max_age, or oldest first past max_entries."""
+
+    def __init__(self, max_age: timedelta, threshold: float = 0.8, max_entries: int = 20000):
+        self.max_age = max_age
+        self.threshold = threshold
+        self.max_entries = max_entries
+        # Message ID -> (posted at, author ID, signature, band keys), oldest first
+        self.entries = OrderedDict()
+        self.buckets = [{} for _ in range(BANDS)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find(self, signature: Tuple[int], author_id: int, now: datetime) -> Optional[Tuple[int, int, float]]:
+        """Find the most similar recent post by another author.
+        Returns (message ID, author ID, similarity), or None if nothing reaches the threshold."""
+        candidates = set()
+        for bucket, key in zip(self.buckets, self.band_keys(signature)):
+            candidates.update(bucket.get(key, ()))
+
+        best = None
+        for message_id in candidates:
+            posted_at, other_author_id, other_signature, _ = self.entries[message_id]
+            if other_author_id == author_id or now - posted_at > self.max_age:
+                continue
+            score = similarity(signature, other_signature)
+            if score >= self.threshold and (best is None or score > best[2]):
+                best = (message_id, other_author_id, score)
+        return best
+
+    def add(self, message_id: int, author_id: int, signature: Tuple[int], posted_at: datetime):
+        self.remove(message_id)
+        band_keys = self.band_keys(signature)
+        self.entries[message_id] = (posted_at, author_id, signature, band_keys)
+        for bucket, key in zip(self.buckets, band_keys):
+            bucket.setdefault(key, set()).add(message_id)
+        self.evict(posted_at)
+
+    def remove(self, message_id: int):
+        entry = self.entries.pop(message_id, None)
+        if entry is None:
+            return
+        for bucket, key in zip(self.buckets, entry[3]):
+            message_ids = bucket[key]
+            message_ids.discard(message_id)
+            if not message_ids:
+                del bucket[key]
+
+    def evict(self, now: datetime):
+        """Drop entries that are too old, and the oldest entries if the index is over capacity"""
+        while self.entries:
+            message_id, (posted_at, _, _, _) = next(iter(self.entries.items()))
+            if now - posted_at <= self.max_age and len(self.entries) <= self.max_entries:
+                break
+            self.remove(message_id)
+
+    @staticmethod
+    def band_keys(signature: Tuple[int]) -> Tuple[int]:
+        return tuple(hash(signature[i * ROWS:(i + 1) * ROWS]) for i in range(BANDS))
+
+
+def benchmark(indexed_posts: int = 10000, queries: int = 2000):
+    """Time make_signature + find + add per post against an index holding indexed_posts posts"""
+    rng = random.Random(1)
+    vocabulary = [f"word{i}" for i in range(5000)] + ["3080", "ryzen", "£450", "collection", "posted", "boxed", "mint"]
+
+    def make_post():
+        return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(10, 80)))
+
+    index = NearDuplicateIndex(max_age=timedelta(days=3), max_entries=indexed_posts + queries)
+    now = datetime.utcnow()
+    for message_id in range(indexed_posts):
+        index.add(message_id, message_id, make_signature(make_post()), now)
+
+    posts = [make_post() for _ in range(queries)]
+    # Half of the queries are lightly edited reposts of a post indexed from another author
+    for i in range(0, queries, 2):
+        index.add(indexed_posts + i, -(i + 1), make_signature(posts[i]), now)
+        words = posts[i].split()
+        words[-1] = "edited"
+        posts[i] = " ".join(words)
+
+    matches = 0
+    start = time.perf_counter()
+    for i, post in enumerate(posts):
+        signature = make_signature(post)
+        if index.find(signature, i, now):
+            matches += 1
+        index.add(indexed_posts + queries + i, i, signature, now)
+    elapsed = time.perf_counter() - start
+
+    print(f"{len(index)} posts indexed, {queries} posts checked, {matches} near-duplicates found")
+    print(f"{elapsed / queries * 1e6:.1f} µs per post")
+
+
+if __name__ == "__main__":
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 10000)
@@ -0,0 +1,88 @@
+"""Times module imports and extension loads for bot.py's --profile-startup mode.
+Installed before anything heavy is imported, so third-party libraries are timed as well as our own modules."""
+import importlib.abc
+import logging
+import sys
+import time
+
+# Modules and extensions shown in the report
+REPORT_LINES = 25
+
+
+class ImportTimer(importlib.abc.MetaPathFinder):
+    """Wraps every loader found by the other finders so executing each module is timed.
+    Self time excludes the modules it imports in turn, like python -X importtime."""
+
+    def __init__(self):
+        # Module name -> (cumulative seconds, self seconds)
+        self.timings = {}
+        self.stack = []
+
+    def find_spec(self, name, path, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                    spec.loader = TimedLoader(spec.loader, self)
+                return spec
+        return None
+
+    def record(self, name: str, exec_module, module):
+        self.stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            exec_module(module)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = self.stack.pop()
+            if self.stack:
+                self.stack[-1] += elapsed
+            self.timings[name] = (elapsed, elapsed - children)
+
+
+class TimedLoader(importlib.abc.Loader):
+    def __init__(self, loader, timer: ImportTimer):
+        self.loader = loader
+        self.timer = timer
+
+    def create_module(self, spec):
+        return self.loader.create_module(spec)
+
+    def exec_module(self, module):
+        self.timer.record(module.__name__, self.loader.exec_module, module)
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+
+timer = ImportTimer()
+# Extension name -> seconds taken to load it
+extension_timings = {}
+reported = False
+
+
+def install():
+    sys.meta_path.insert(0, timer)
+
+
+def report(started: float) -> str:
+    """Describe where startup time went, given the perf_counter() reading taken when the bot started"""
+    lines = [f"Startup profile: ready {time.perf_counter() - started:.2f}s after start"]
+    lines.append(f"Extensions loaded ({sum(extension_timings.values()):.2f}s total):")
+    for name, seconds in sorted(extension_timings.items(), key=lambda i: i[1], reverse=True):
+        lines.append(f"  {seconds * 1000:8.1f} ms  {name}")
+    lines.append(f"Slowest of {len(timer.timings)} module imports by self time (cumulative in brackets):")
+    slowest = sorted(timer.timings.items(), key=lambda i: i[1][1], reverse=True)[:REPORT_LINES]
+    for name, (cumulative, own) in slowest:
+        lines.append(f"  {own * 1000:8.1f} ms  ({cumulative * 1000:8.1f} ms)  {name}")
+    return "\n".join(lines)
+
+
+def log_report(started: float):
+    """Log the report the first time the bot is ready, not on every reconnect"""
+    global reported
+    if not reported:
+        reported = True
+        logging.info(report(started))
@@ -0,0 +1,41 @@
+"""Trade flairs and their Discord roles from config.json, looked up once at import rather than on every command."""
+import json
+from types import MappingProxyType
+
+with open('config.json', 'r') as f:
+    conf = json.load(f)
+
+# Flair name -> rank, lowest first, in the order they appear in config.json
+FLAIR_RANKS = MappingProxyType({name: rank for rank, name in enumerate(conf['flairs'])})
+# Flair name -> trade role ID
+ROLE_IDS = MappingProxyType({name: int(conf['flairs'][name]['rid']) for name in conf['flairs']})
+# Trade role ID -> flair name
+TRADE_ROLES = MappingProxyType({rid: name for name, rid in ROLE_IDS.items()})
+# Trade role ID -> rank
+ROLE_RANKS = MappingProxyType({rid: FLAIR_RANKS[name] for rid, name in TRADE_ROLES.items()})
+TRADE_ROLE_IDS = frozenset(TRADE_ROLES)
+
+
+def flair_from_text(flair_text: str) -> str:
+    """Get the flair name from Reddit flair text such as '10+ Trades'"""
+    if not flair_text:
+        return None
+    name = flair_text.split(' ')[0]
+    return name if name in FLAIR_RANKS else None
+
+
+def highest_flair(*flairs) -> str:
+    flairs = [i for i in flairs if i is not None]
+    return max(flairs, key=FLAIR_RANKS.get) if flairs else None
+
+
+def trade_roles_of(roles: list) -> list:
+    """Get the trade roles among roles, highest rank first"""
+    return sorted((i for i in roles if i.id in TRADE_ROLE_IDS), key=lambda i: ROLE_RANKS[i.id], reverse=True)
+
+
+def with_trade_role(roles: list, role) -> list:
+    """Get roles with every trade role swapped for role, ready for a single member edit.
+    The @everyone role is left out, as Discord doesn't accept it in a role edit."""
+    kept = [i for i in roles if i.id not in TRADE_ROLE_IDS and not i.is_default()]
+    return kept + [role]
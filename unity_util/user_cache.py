@@ -0,0 +1,101 @@
+"""In-process LRU + TTL cache of verified user documents, addressable by any of their lookup keys."""
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+# Lookup fields; names are compared case-insensitively, as get_user does
+KEY_FIELDS = ('discord.id', 'reddit.name', 'discord.username', 'discord.name')
+
+
+def make_key(field: str, value: str) -> Tuple[str, str]:
+    return (field, value if field == 'discord.id' else value.lower())
+
+
+def guess_key(lookups: list) -> tuple:
+    """Key for a lookup trying several fields in order, e.g. a name that may be Reddit or Discord"""
+    return ('guess', tuple(make_key(field, value) for field, value in lookups))
+
+
+def user_keys(user: dict) -> list:
+    keys = []
+    for field in KEY_FIELDS:
+        section, name = field.split('.')
+        value = user.get(section, {}).get(name)
+        if value:
+            keys.append(make_key(field, str(value)))
+    return keys
+
+
+class UserDirectoryCache:
+    """Each cached user is stored once per lookup key, and evicted or invalidated across all of them at once"""
+
+    def __init__(self, max_size: int = 2048, ttl: float = 300):
+        self.max_size = max_size
+        self.ttl = ttl
+        # Lookup key -> (user document, expiry), least recently used first
+        self.entries = OrderedDict()
+        # Discord ID -> lookup keys of that user's document
+        self.keys_by_id = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.keys_by_id)
+
+    def find(self, lookups: Iterable[Tuple[str, str]]) -> Optional[dict]:
+        """Get the cached user for the (field, value) lookups, counting a hit or a miss.
+        Several lookups are only answered by the result of the same lookups before: a cached user matching
+        a later field can't rule out an uncached user matching an earlier one, which the database would prefer."""
+        now = time.monotonic()
+        lookups = list(lookups)
+        keys = [guess_key(lookups)] if len(lookups) > 1 else [make_key(field, value) for field, value in lookups]
+        for key in keys:
+            entry = self.entries.get(key)
+            if entry is None:
+                continue
+            user, expires_at = entry
+            if expires_at < now:
+                self.invalidate(user['discord']['id'])
+                continue
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return user
+        self.misses += 1
+        return None
+
+    def put(self, user: dict, lookups: list = None):
+        """Cache a user under each of their lookup keys, and under lookups if they were found by trying several"""
+        discord_id = str(user['discord']['id'])
+        self.invalidate(discord_id)
+        keys = user_keys(user)
+        if lookups is not None and len(lookups) > 1:
+            keys.append(guess_key(lookups))
+        expires_at = time.monotonic() + self.ttl
+        for key in keys:
+            # Another user may have held this name before; drop them rather than serve the wrong person
+            previous = self.entries.get(key)
+            if previous is not None:
+                self.invalidate(previous[0]['discord']['id'])
+            self.entries[key] = (user, expires_at)
+        self.keys_by_id[discord_id] = keys
+
+        while len(self.keys_by_id) > self.max_size:
+            _, (oldest, _) = next(iter(self.entries.items()))
+            self.invalidate(oldest['discord']['id'])
+
+    def invalidate(self, discord_id):
+        for key in self.keys_by_id.pop(str(discord_id), ()):
+            self.entries.pop(key, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_id.clear()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }